@@ -0,0 +1,360 @@
+# Copyright 2014 Michael Trunner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark suite for the IoC container.
+
+Run all benchmarks::
+
+    python benchmarks/bench_ioc.py
+
+Save the results as baseline and compare a later run against it::
+
+    python benchmarks/bench_ioc.py --save baseline.json
+    python benchmarks/bench_ioc.py --compare baseline.json
+
+The compare run exits with status 1, when a benchmark is slower than the
+baseline by more than the --threshold (default 20%). Select benchmarks
+by passing their names. --memory additionally reports the memory of a
+context and the memory, that freezing it adds.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from djhelpers.ioc import (ApplicationContext, Inject, ObjectDefinition,
+                           RequestApplicationContext)
+
+PROTOTYPE = ObjectDefinition.SCOPE_PROTOTYPE
+
+BENCHMARKS = []
+
+
+def benchmark(number):
+    """
+    Registers a benchmark. The decorated function sets the benchmark up
+    and returns the callable, that is timed number times per repeat.
+    """
+    def wrap(func):
+        BENCHMARKS.append((func.__name__[len('bench_'):], number, func))
+        return func
+    return wrap
+
+
+class Service(object):
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Request(object):
+
+    def __init__(self):
+        self.session = {}
+
+
+def _eval_arg(ioc_container, arg):
+    """
+    The recursive argument evaluation, that was used before the
+    resolution plans were introduced.
+    """
+    if isinstance(arg, Inject):
+        return arg(ioc_container)
+    elif isinstance(arg, (list, tuple, set)):
+        return [_eval_arg(ioc_container, a) for a in arg]
+    elif isinstance(arg, dict):
+        return dict((k, _eval_arg(ioc_container, arg[k])) for k in arg)
+    else:
+        return arg
+
+
+def _create_context():
+    context = ApplicationContext()
+    context.register('dep', Service)
+    context.register('prototype', Service,
+                     args=[1, 'two', (3, 4, 5), Inject('dep')],
+                     kwargs={'a': [1, 2, 3], 'b': {'c': 'd', 'e': 'f'},
+                             'dep': Inject('dep')},
+                     scope=PROTOTYPE)
+    context.register('request', Service, [Inject('dep')],
+                     scope=ObjectDefinition.SCOPE_REQUEST)
+    return context
+
+
+@benchmark(1000000)
+def bench_singleton_get():
+    context = _create_context()
+    context.get('dep')
+    return lambda: context.get('dep')
+
+
+@benchmark(1000000)
+def bench_frozen_singleton_get_by_handle():
+    frozen = _create_context().freeze()
+    frozen.get('dep')
+    handle = frozen.get_handle('dep')
+    return lambda: frozen.get_by_handle(handle)
+
+
+@benchmark(1000000)
+def bench_frozen_singleton_accessor():
+    frozen = _create_context().freeze()
+    frozen.get('dep')
+    return frozen.accessor('dep')
+
+
+@benchmark(100000)
+def bench_factory_call():
+    return lambda: Service(1, 'two', (3, 4, 5), None,
+                           a=[1, 2, 3], b={'c': 'd', 'e': 'f'}, dep=None)
+
+
+@benchmark(100000)
+def bench_prototype_get_shallow():
+    context = _create_context()
+    return lambda: context.get('prototype')
+
+
+@benchmark(100000)
+def bench_frozen_prototype_accessor():
+    frozen = _create_context().freeze()
+    return frozen.accessor('prototype')
+
+
+@benchmark(100000)
+def bench_prototype_get_runtime_arguments():
+    context = _create_context()
+    return lambda: context.get('prototype', 'EUR', locale='de')
+
+
+@benchmark(100000)
+def bench_prototype_get_memoized():
+    context = _create_context()
+    context.register('memoized', Service, [Inject('dep')],
+                     scope=PROTOTYPE, memoize=16)
+    return lambda: context.get('memoized', 'EUR', locale='de')
+
+
+@benchmark(100000)
+def bench_prototype_get_shallow_eval_arg():
+    context = _create_context()
+    object_def = context._get_object_def('prototype')
+
+    def create():
+        args = _eval_arg(context, object_def.args)
+        kwargs = _eval_arg(context, object_def.kwargs)
+        return object_def.factory(*args, **kwargs)
+    return create
+
+
+@benchmark(10000)
+def bench_prototype_get_deep():
+    context = ApplicationContext()
+    context.register(0, Service, scope=PROTOTYPE)
+    for i in range(1, 20):
+        context.register(i, Service, [Inject(i - 1)], scope=PROTOTYPE)
+    return lambda: context.get(19)
+
+
+@benchmark(10000)
+def bench_prototype_get_wide():
+    context = ApplicationContext()
+    for i in range(20):
+        context.register(i, Service)
+    context.register('wide', Service, [Inject(i) for i in range(10)],
+                     dict(('kw%d' % i, Inject(i)) for i in range(10, 20)),
+                     scope=PROTOTYPE)
+    return lambda: context.get('wide')
+
+
+def _create_batch_context():
+    context = ApplicationContext()
+    context.register('shared', Service, scope=PROTOTYPE)
+    for i in range(15):
+        context.register(i, Service, [Inject('shared')], scope=PROTOTYPE)
+    return context
+
+
+@benchmark(10000)
+def bench_get_15_prototypes():
+    context = _create_batch_context()
+    return lambda: [context.get(i) for i in range(15)]
+
+
+@benchmark(10000)
+def bench_get_many_15_prototypes():
+    context = _create_batch_context()
+    return lambda: context.get_many(range(15))
+
+
+@benchmark(100000)
+def bench_request_get_warm():
+    context = RequestApplicationContext(_create_context(), Request())
+    context.get('request')
+    return lambda: context.get('request')
+
+
+@benchmark(100000)
+def bench_request_get_cold():
+    app_context = _create_context()
+
+    def request():
+        RequestApplicationContext(app_context, Request()).get('request')
+    return request
+
+
+@benchmark(100000)
+def bench_request_get_singleton():
+    context = RequestApplicationContext(_create_context(), Request())
+    return lambda: context.get('dep')
+
+
+@benchmark(5)
+def bench_load_config_5000():
+    config = [(i, Service, [Inject(i - 1)] if i else None,
+               {'name': 'service %d' % i})
+              for i in range(5000)]
+    return lambda: ApplicationContext(config)
+
+
+@benchmark(5)
+def bench_concurrent_cold_singletons():
+    def factory():
+        time.sleep(0.0001)
+        return Service()
+
+    def run():
+        context = ApplicationContext([(i, factory) for i in range(100)])
+        barrier = threading.Barrier(8)
+
+        def worker():
+            barrier.wait()
+            for i in range(100):
+                context.get(i)
+        workers = [threading.Thread(target=worker) for _ in range(8)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+    return run
+
+
+def measure_freeze_memory(size=5000):
+    """
+    Measures the memory of a context with size definitions and the
+    memory, that freezing it adds. The frozen context keeps the context
+    alive, freezing speeds up lookups by handle at the cost of memory.
+
+    :return: the allocated bytes by name
+    :rtype: dict
+    """
+    config = [(i, Service, [Inject(i - 1)] if i else None)
+              for i in range(size)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        context = ApplicationContext(config)
+        frozen_before = tracemalloc.get_traced_memory()[0]
+        frozen = context.freeze()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del frozen
+    return {'context': frozen_before - before,
+            'freeze_overhead': after - frozen_before}
+
+
+def run_benchmarks(names=None, repeat=7):
+    """
+    Runs the selected benchmarks.
+
+    :return: the min and median time per call in microseconds by name
+    :rtype: dict
+    """
+    results = {}
+    for name, number, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        func = setup()
+        timings = [t / number * 1e6 for t in
+                   timeit.repeat(func, number=number, repeat=repeat)]
+        results[name] = {'min': min(timings),
+                         'median': statistics.median(timings)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the results next to the baseline.
+
+    :return: the names of the benchmarks that have regressed
+    :rtype: list
+    """
+    regressions = []
+    for name in sorted(results):
+        current = results[name]['min']
+        if name not in baseline:
+            print('%-36s %12.3f us' % (name, current))
+            continue
+        base = baseline[name]['min']
+        change = (current - base) / base * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-36s %12.3f us  baseline %12.3f us  %+7.1f%%%s'
+              % (name, current, base, change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='allowed slowdown in percent')
+    parser.add_argument('--memory', action='store_true',
+                        help='report the memory of a context and the memory, '
+                        'that freezing it adds')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, args.repeat)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.threshold)
+    if args.memory:
+        for name, size in sorted(measure_freeze_memory().items()):
+            print('%-36s %12d bytes' % (name, size))
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,9 +15,23 @@
 """
 Some django admin helper classes and decorators.
 """
+import collections
+import contextlib
+import contextvars
+import functools
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # The shot_description decorator can be helpful in the django admin, too.
 from djhelpers.modelhelpers import short_description  # pylint: disable=unused-import
+from djhelpers.modelhelpers import request_cache
+
+logger = logging.getLogger(__name__)
 
 
 class ActionDecorator(list):
@@ -40,30 +54,885 @@ class ActionDecorator(list):
     ...     def make_published(self, request, queryset):
     ...         queryset.update(status='p')
     ...
+    ...     @actions.action("Recalculate the totals", chunk_size=1000)
+    ...     def recalculate(self, request, queryset):
+    ...         for story in queryset:
+    ...             story.recalculate()
+    ...
+    ...     @actions.action("Export the stories", background=True)
+    ...     def export(self, request, queryset):
+    ...         return write_export(queryset)
+    ...
     >>>
     """
 
-    def action(self, description):
+    def action(self, description, chunk_size=None, background=False,
+               backend=None):
         """
         Adds a short_description field to the decorated method and
         adds it to the (admin actions) list.
 
+        With a chunk_size the action is called once per batch of at most
+        chunk_size selected objects, see chunked_action. Background
+        actions are queued as job and the request returns immediately,
+        see background_action.
+
         :param description: the value for the short description attribute
         :type description: str or unicode
+        :param chunk_size: the max. number of objects per batch
+        :type chunk_size: int or None
+        :param background: run the action as background job
+        :type background: bool
+        :param backend: the job backend of a background action, defaults
+                        to get_job_backend()
+        :type backend: LocalJobBackend
 
         :return: the decorator function
         :rtype: function
         """
         def wrap(func):  # pylint: disable=missing-docstring
+            if chunk_size:
+                func = chunked_action(func, chunk_size)
+            if background or backend is not None:
+                func = background_action(func, description, backend)
             # set description
             func.short_description = description
             # add function to admin actions
             self.append(func)
-            # we do not need to modify the function
+            # chunked and background actions return the wrapper
             return func
         return wrap
 
 
+def iter_batches(queryset, chunk_size):
+    """
+    Splits a queryset into querysets of at most chunk_size objects,
+    ordered by primary key.
+
+    The batches are paginated by the last primary key of the previous
+    batch instead of offsets, so every batch is a cheap index range
+    and objects changed by the caller are neither skipped nor repeated.
+    Only the primary keys of one batch are held in memory.
+
+    :param queryset: the queryset to split
+    :type queryset: django.db.models.query.QuerySet
+    :param chunk_size: the max. number of objects per batch
+    :type chunk_size: int
+
+    :return: generator of querysets
+    :rtype: generator
+    """
+    ordered = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        page = ordered if last_pk is None else ordered.filter(pk__gt=last_pk)
+        pks = list(page.values_list('pk', flat=True)[:chunk_size].iterator())
+        if not pks:
+            return
+        last_pk = pks[-1]
+        yield ordered.filter(pk__in=pks)
+        if len(pks) < chunk_size:
+            return
+
+
+def chunked_action(func, chunk_size):
+    """
+    Wraps a admin action, so it is called with successive batches of the
+    selected objects instead of the whole queryset, see iter_batches.
+    Every batch runs in its own transaction, so a failing batch only
+    rolls back itself and no transaction is held for the whole run.
+
+    :param func: the admin action
+    :type func: function
+    :param chunk_size: the max. number of objects per batch
+    :type chunk_size: int
+
+    :return: the wrapped action, it returns the last response of the
+             action that was not None
+    :rtype: function
+    """
+    @functools.wraps(func)
+    def wrapper(modeladmin, request, queryset):
+        # pylint: disable=missing-docstring
+        from django.db import transaction
+        response = None
+        for batch in iter_batches(queryset, chunk_size):
+            with transaction.atomic(using=queryset.db):
+                result = func(modeladmin, request, batch)
+            if result is not None:
+                response = result
+        return response
+    wrapper.chunk_size = chunk_size
+    return wrapper
+
+
+class Job(object):
+    """
+    The state of a background action, see LocalJobBackend.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, name):
+        """
+        Constructor
+
+        :param name: the display name of the job
+        :type name: str
+        """
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = self.QUEUED
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+        self._future = None
+
+    def set_progress(self, done, total=None):
+        """
+        Records the progress of the job, call it from the action with
+        current_job().set_progress(...).
+
+        :param done: the number of processed items
+        :type done: int
+        :param total: the number of all items, if known
+        :type total: int or None
+        """
+        self.progress = (done, total)
+
+    def is_finished(self):
+        # pylint: disable=missing-docstring
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the job is finished.
+
+        :param timeout: max. seconds to wait, None waits forever
+        :type timeout: float or None
+
+        :return: True, when the job is finished
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def _start(self):
+        # pylint: disable=missing-docstring
+        self.status = self.RUNNING
+        self.started = time.time()
+
+    def _poll(self):
+        # pylint: disable=missing-docstring
+        # a job of a process pool is running, once the executor has
+        # handed it to a worker process
+        future = self._future
+        if future is not None and self.status == self.QUEUED and \
+                future.running():
+            self._start()
+
+    def _finish(self, result=None, error=None):
+        # pylint: disable=missing-docstring
+        if error is None:
+            self.status = self.DONE
+            self.result = result
+        else:
+            self.status = self.FAILED
+            self.error = '%s: %s' % (type(error).__name__, error)
+        self.finished = time.time()
+        self._done.set()
+
+    def as_dict(self):
+        """
+        Returns the state of the job as JSON serializable dict. The
+        result is included as its string representation.
+
+        :rtype: dict
+        """
+        self._poll()
+        done, total = self.progress or (None, None)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'progress': done,
+            'total': total,
+            'result': None if self.result is None else str(self.result),
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+_current_job = threading.local()
+
+
+def _close_old_connections():
+    """
+    Closes the database connections of the current thread, that are
+    broken or older than CONN_MAX_AGE, so long running worker threads do
+    not reuse them. Without configured Django settings there are no
+    connections to close.
+    """
+    try:
+        from django.conf import settings
+        from django.db import close_old_connections
+    except ImportError:
+        return
+    if settings.configured:
+        close_old_connections()
+
+
+def current_job():
+    """
+    Returns the job of the background action, that runs in the current
+    thread, or None. Progress is only reported for jobs on threads.
+
+    :rtype: Job or None
+    """
+    return getattr(_current_job, 'job', None)
+
+
+class LocalJobBackend(object):
+    """
+    Runs background actions on a local executor, no broker needed.
+
+    The default executor is a thread pool. With a ProcessPoolExecutor
+    the action is looked up again in the worker process by its model and
+    name from the registered model admins and called with the request
+    None, because requests cannot be pickled. Other queues can be
+    plugged in by implementing submit and get_job.
+
+    Only the max_jobs newest jobs are kept, queued and running jobs are
+    never dropped. Every job closes the stale database connections of
+    its worker before and after it runs, like a Django request does.
+    """
+
+    def __init__(self, executor=None, max_workers=2, max_jobs=1000):
+        """
+        Constructor
+
+        :param executor: the executor, defaults to a thread pool
+        :type executor: concurrent.futures.Executor
+        :param max_workers: the number of threads of the default pool
+        :type max_workers: int
+        :param max_jobs: the number of jobs kept for the status API
+        :type max_jobs: int
+        """
+        self._executor = executor
+        self._max_workers = max_workers
+        self._max_jobs = max_jobs
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # pylint: disable=missing-docstring
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self._max_workers, thread_name_prefix='admin-action')
+            return self._executor
+
+    @property
+    def uses_processes(self):
+        # pylint: disable=missing-docstring
+        return isinstance(self._executor, ProcessPoolExecutor)
+
+    def submit(self, name, func, *args):
+        """
+        Queues func(*args) as job.
+
+        :param name: the display name of the job
+        :type name: str
+        :param func: the callable, it must be picklable for process pools
+        :type func: callable
+
+        :return: the queued job
+        :rtype: Job
+        """
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+            excess = len(self._jobs) - self._max_jobs
+            if excess > 0:
+                finished = [job_id for job_id, kept in self._jobs.items()
+                            if kept.is_finished()]
+                for job_id in finished[:excess]:
+                    del self._jobs[job_id]
+        if self.uses_processes:
+            future = job._future = self.executor.submit(func, *args)
+            future.add_done_callback(functools.partial(self._done, job))
+        else:
+            self.executor.submit(self._run, job, func, args)
+        return job
+
+    @staticmethod
+    def _run(job, func, args):
+        # pylint: disable=missing-docstring
+        job._start()
+        _current_job.job = job
+        try:
+            _close_old_connections()
+            result = func(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Background action "%s" failed', job.name)
+            job._finish(error=e)
+        else:
+            job._finish(result)
+        finally:
+            _current_job.job = None
+            _close_old_connections()
+
+    @staticmethod
+    def _done(job, future):
+        # pylint: disable=missing-docstring
+        error = future.exception()
+        if error is not None:
+            logger.error('Background action "%s" failed: %s', job.name, error)
+            job._finish(error=error)
+        else:
+            job._finish(future.result())
+
+    def get_job(self, job_id):
+        """
+        Returns the job with the given id or None.
+
+        :rtype: Job or None
+        """
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        """
+        Returns all kept jobs, the oldest first.
+
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, wait=True):
+        """
+        Shuts the executor down.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait)
+
+
+_job_backend = None
+
+
+def get_job_backend():
+    """
+    Returns the default job backend of background actions, a
+    LocalJobBackend unless set_job_backend was called.
+    """
+    global _job_backend  # pylint: disable=global-statement
+    if _job_backend is None:
+        _job_backend = LocalJobBackend()
+    return _job_backend
+
+
+def set_job_backend(backend):
+    """
+    Replaces the default job backend of background actions.
+    """
+    global _job_backend  # pylint: disable=global-statement
+    _job_backend = backend
+
+
+def _run_in_process(model_label, action_name, pks, using):
+    """
+    Calls a background action in a worker process of a process pool.
+    """
+    import django
+    django.setup()
+    from django.apps import apps
+    from django.contrib import admin
+    model = apps.get_model(model_label)
+    modeladmin = admin.site._registry[model]  # pylint: disable=protected-access
+    action = getattr(type(modeladmin), action_name).__wrapped__
+    queryset = model._default_manager.using(using).filter(pk__in=pks)
+    _close_old_connections()
+    try:
+        return action(modeladmin, None, queryset)
+    finally:
+        _close_old_connections()
+
+
+def background_action(func, description=None, backend=None):
+    """
+    Wraps a admin action, so it is queued as job on the job backend.
+    The admin gets a "queued" message with the job id, that can be
+    looked up with job_status or the job_status_view.
+
+    :param func: the admin action
+    :type func: function
+    :param description: the job name, defaults to the function name
+    :type description: str or None
+    :param backend: the job backend, defaults to get_job_backend()
+    :type backend: LocalJobBackend
+
+    :return: the wrapped action
+    :rtype: function
+    """
+    name = description or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(modeladmin, request, queryset):
+        # pylint: disable=missing-docstring
+        job_backend = backend or get_job_backend()
+        if getattr(job_backend, 'uses_processes', False):
+            job = job_backend.submit(
+                name, _run_in_process, queryset.model._meta.label,
+                func.__name__, list(queryset.values_list('pk', flat=True)),
+                queryset.db)
+        else:
+            job = job_backend.submit(name, func, modeladmin, request,
+                                     queryset)
+        modeladmin.message_user(
+            request, 'Queued "%s" as job %s.' % (name, job.id))
+    wrapper.background = True
+    return wrapper
+
+
+def job_status(job_id, backend=None):
+    """
+    Returns the state of a background job as dict, see Job.as_dict.
+
+    :param job_id: the id of the job
+    :type job_id: str
+    :param backend: the job backend, defaults to get_job_backend()
+    :type backend: LocalJobBackend
+
+    :return: the state or None, if the job is unknown
+    :rtype: dict or None
+    """
+    job = (backend or get_job_backend()).get_job(job_id)
+    return None if job is None else job.as_dict()
+
+
+def job_status_view(request, job_id):
+    """
+    Django view, that returns the state of a background job as JSON.
+    Only staff users are allowed to see it.
+
+    Usage:
+
+    >>> urlpatterns = [
+    ...     url(r'^admin/jobs/(?P<job_id>[0-9a-f]+)/$', job_status_view),
+    ... ]
+    """
+    from django.http import Http404, JsonResponse
+    from django.core.exceptions import PermissionDenied
+    if not request.user.is_active or not request.user.is_staff:
+        raise PermissionDenied
+    status = job_status(job_id)
+    if status is None:
+        raise Http404('Unknown job %s' % job_id)
+    return JsonResponse(status)
+
+
+def collect_query_hints(functions):
+    """
+    Merges the query hints of functions decorated by short_description.
+
+    :param functions: the decorated functions, others are ignored
+    :type functions: iterable
+
+    :return: the select_related and prefetch_related lookups and the
+             annotations by name
+    :rtype: tuple
+    """
+    select_related = []
+    prefetch_related = []
+    annotations = {}
+    for func in functions:
+        for lookup in getattr(func, 'select_related', ()):
+            if lookup not in select_related:
+                select_related.append(lookup)
+        for lookup in getattr(func, 'prefetch_related', ()):
+            if lookup not in prefetch_related:
+                prefetch_related.append(lookup)
+        annotations.update(getattr(func, 'annotations', {}))
+    return select_related, prefetch_related, annotations
+
+
+def apply_query_hints(queryset, hints):
+    """
+    Applies the query hints of collect_query_hints to a queryset.
+
+    :rtype: django.db.models.query.QuerySet
+    """
+    select_related, prefetch_related, annotations = hints
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if annotations:
+        queryset = queryset.annotate(**annotations)
+    return queryset
+
+
+_changelist_admin = contextvars.ContextVar('admin_changelist_admin',
+                                           default=None)
+
+
+class QueryHintsModelAdminMixin(object):
+    """
+    This mixin applies the query hints of the list_display functions,
+    see short_description, once to the queryset of the changelist. So
+    the changelist renders with a constant number of queries instead of
+    following the relations row by row. The querysets of the change
+    form, the delete views and the admin actions are left unchanged.
+    """
+
+    def get_changelist_instance(self, request):
+        # pylint: disable=missing-docstring
+        if _is_action_request(request):
+            # the changelist is not rendered, its queryset is only passed
+            # to the action
+            return super(QueryHintsModelAdminMixin,
+                         self).get_changelist_instance(request)
+        token = _changelist_admin.set(self)
+        try:
+            return super(QueryHintsModelAdminMixin,
+                         self).get_changelist_instance(request)
+        finally:
+            _changelist_admin.reset(token)
+
+    def get_queryset(self, request):
+        # pylint: disable=missing-docstring
+        queryset = super(QueryHintsModelAdminMixin,
+                         self).get_queryset(request)
+        if _changelist_admin.get() is not self:
+            return queryset
+        return apply_query_hints(queryset, self.get_query_hints(request))
+
+    def get_query_hints(self, request):
+        """
+        Collects the query hints of all list_display columns.
+        """
+        functions = []
+        for name in self.get_list_display(request):
+            if callable(name):
+                functions.append(name)
+            elif hasattr(self, name):
+                functions.append(getattr(self, name))
+            elif hasattr(self.model, name):
+                attr = getattr(self.model, name)
+                # the hints of a property are on its getter
+                functions.append(getattr(attr, 'fget', attr))
+        return collect_query_hints(functions)
+
+
+def _is_action_request(request):
+    """
+    Returns, whether the changelist view runs a admin action for the
+    request instead of rendering the changelist.
+    """
+    if request.method != 'POST' or '_save' in request.POST:
+        return False
+    from django.contrib.admin import helpers
+    return 'index' in request.POST or \
+        helpers.ACTION_CHECKBOX_NAME in request.POST
+
+
+class RequestCacheModelAdminMixin(object):
+    """
+    This mixin runs the changelist and the change form inside a
+    request_cache, so the short_description functions with cache=True
+    are computed once per object and request. The template response is
+    rendered with the same cache, when the handler renders it.
+    """
+
+    request_cache_size = 1024
+
+    def changelist_view(self, request, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        return self._cached_view(super(RequestCacheModelAdminMixin,
+                                       self).changelist_view,
+                                 request, *args, **kwargs)
+
+    def changeform_view(self, request, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        return self._cached_view(super(RequestCacheModelAdminMixin,
+                                       self).changeform_view,
+                                 request, *args, **kwargs)
+
+    def _cached_view(self, view, request, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        with request_cache(self.request_cache_size) as cache:
+            response = view(request, *args, **kwargs)
+        _defer_render(response, functools.partial(request_cache,
+                                                  cache=cache))
+        return response
+
+
+def _defer_render(response, enter, done=None):
+    """
+    Makes a lazy template response render inside the context manager
+    returned by enter() and calls done after the rendering. Unlike
+    rendering it right away, changes of its context data by overriding
+    views or template response middleware still take effect.
+
+    :return: False, if the response is not lazy
+    :rtype: bool
+    """
+    render = getattr(response, 'render', None)
+    if not callable(render) or getattr(response, 'is_rendered', True):
+        return False
+
+    def render_inside():  # pylint: disable=missing-docstring
+        try:
+            with enter():
+                return render()
+        finally:
+            # drops the wrappers of all mixins, the response is rendered
+            vars(response).pop('render', None)
+            if done is not None:
+                done()
+    response.render = render_inside
+    return True
+
+
+_performance_sample = contextvars.ContextVar('admin_performance_sample',
+                                             default=None)
+
+_IN_LIST = re.compile(r'IN \((?:(?:%s|\?), )*(?:%s|\?)\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def normalize_sql(sql):
+    """
+    Reduces a sql statement to its shape, so the queries of a N+1
+    pattern are equal: literals are replaced by ? and IN lists of any
+    length by IN (...).
+
+    :param sql: the sql statement
+    :type sql: str
+
+    :rtype: str
+    """
+    return _IN_LIST.sub('IN (...)', _LITERALS.sub('?', sql))
+
+
+class PerformanceSample(object):
+    """
+    The measurements of one admin view, see PerformanceModelAdminMixin.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.total_time = 0.0
+        self.query_count = 0
+        self.query_time = 0.0
+        self.columns = {}
+        self.query_shapes = collections.Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute wrapper of the database connection
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - started
+            self.query_count += 1
+            self.query_shapes[normalize_sql(sql)] += 1
+
+    def add_column_time(self, name, elapsed):
+        # pylint: disable=missing-docstring
+        self.columns[name] = self.columns.get(name, 0.0) + elapsed
+
+    def repeated_queries(self, threshold):
+        """
+        Returns the query shapes, that were executed at least threshold
+        times, i.e. the likely N+1 patterns, by their count.
+
+        :rtype: dict
+        """
+        return dict((sql, count) for sql, count in self.query_shapes.items()
+                    if count >= threshold)
+
+
+class PerformanceStats(object):
+    """
+    In-process registry of the aggregated PerformanceSamples by view.
+    """
+
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, sample, repeated_queries):
+        """
+        Adds a sample to the aggregate of its view.
+        """
+        with self._lock:
+            stats = self._views.setdefault(sample.view, {
+                'count': 0, 'total_time': 0.0, 'max_time': 0.0,
+                'query_count': 0, 'max_query_count': 0, 'query_time': 0.0,
+                'columns': {}, 'n_plus_one': {}})
+            stats['count'] += 1
+            stats['total_time'] += sample.total_time
+            stats['max_time'] = max(stats['max_time'], sample.total_time)
+            stats['query_count'] += sample.query_count
+            stats['max_query_count'] = max(stats['max_query_count'],
+                                           sample.query_count)
+            stats['query_time'] += sample.query_time
+            for name, elapsed in sample.columns.items():
+                stats['columns'][name] = \
+                    stats['columns'].get(name, 0.0) + elapsed
+            for sql in repeated_queries:
+                stats['n_plus_one'][sql] = \
+                    stats['n_plus_one'].get(sql, 0) + 1
+
+    def as_dict(self):
+        """
+        Returns the aggregated samples by view. The times are sums in
+        seconds, n_plus_one counts the samples a query shape was flagged
+        in.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return dict((view, dict(stats, columns=dict(stats['columns']),
+                                    n_plus_one=dict(stats['n_plus_one'])))
+                        for view, stats in self._views.items())
+
+    def reset(self):
+        # pylint: disable=missing-docstring
+        with self._lock:
+            self._views = {}
+
+
+performance_stats = PerformanceStats()
+
+
+def _timed_column(name, func):
+    """
+    Wraps a list_display function, so its time is recorded while a
+    PerformanceSample is active.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # pylint: disable=missing-docstring
+        sample = _performance_sample.get()
+        if sample is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sample.add_column_time(name, time.perf_counter() - started)
+    return wrapper
+
+
+class PerformanceModelAdminMixin(object):
+    """
+    This mixin measures a sample of the changelist and change form
+    views: the query count and time, the total time including the
+    rendering of the template and the time of every list_display
+    function of the admin. Query shapes repeated at least
+    performance_n_plus_one_threshold times are flagged as likely N+1.
+
+    The samples are logged and aggregated in performance_stats. The
+    sample rate is 0 by default, unsampled requests only pay one random
+    number and one context variable lookup per list_display call.
+    Functions of the model and special names like __str__ are not
+    timed.
+    """
+
+    performance_sample_rate = 0.0
+    performance_n_plus_one_threshold = 10
+
+    def __init__(self, *args, **kwargs):
+        super(PerformanceModelAdminMixin, self).__init__(*args, **kwargs)
+        list_display = []
+        for name in self.list_display:
+            if callable(name):
+                name = _timed_column(getattr(name, '__name__', repr(name)),
+                                     name)
+            elif name.startswith('__') and name.endswith('__'):
+                # e.g. the default __str__, it is looked up on the model
+                pass
+            elif callable(getattr(type(self), name, None)):
+                setattr(self, name, _timed_column(name, getattr(self, name)))
+            list_display.append(name)
+        self.list_display = list_display
+
+    def changelist_view(self, request, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        return self._measure('changelist', super(
+            PerformanceModelAdminMixin, self).changelist_view,
+            request, *args, **kwargs)
+
+    def changeform_view(self, request, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        return self._measure('changeform', super(
+            PerformanceModelAdminMixin, self).changeform_view,
+            request, *args, **kwargs)
+
+    def _measure(self, view, view_func, request, *args, **kwargs):
+        """
+        Calls the view and records a PerformanceSample, if the request is
+        sampled. A lazy response is measured, until it is rendered.
+        """
+        if random.random() >= self.performance_sample_rate:
+            return view_func(request, *args, **kwargs)
+        from django.db import connections, router
+        opts = self.model._meta
+        sample = PerformanceSample('%s.%s:%s' % (opts.app_label,
+                                                  opts.model_name, view))
+        alias = router.db_for_read(self.model)
+
+        @contextlib.contextmanager
+        def measuring():  # pylint: disable=missing-docstring
+            token = _performance_sample.set(sample)
+            started = time.perf_counter()
+            try:
+                with connections[alias].execute_wrapper(sample):
+                    yield
+            finally:
+                sample.total_time += time.perf_counter() - started
+                _performance_sample.reset(token)
+
+        with measuring():
+            response = view_func(request, *args, **kwargs)
+        if not _defer_render(response, measuring,
+                             functools.partial(self.report_performance,
+                                               sample)):
+            self.report_performance(sample)
+        return response
+
+    def report_performance(self, sample):
+        """
+        Logs the sample and adds it to performance_stats.
+
+        :param sample: the measurements of a view
+        :type sample: PerformanceSample
+        """
+        repeated = sample.repeated_queries(
+            self.performance_n_plus_one_threshold)
+        performance_stats.record(sample, repeated)
+        logger.info('%s: %.1f ms, %d queries in %.1f ms, columns %s',
+                    sample.view, sample.total_time * 1000,
+                    sample.query_count, sample.query_time * 1000,
+                    ', '.join('%s %.1f ms' % (name, elapsed * 1000)
+                              for name, elapsed in
+                              sorted(sample.columns.items())) or '-')
+        for sql, count in repeated.items():
+            logger.warning('%s: likely N+1, %d times: %s',
+                           sample.view, count, sql)
+
+
 class NoDeleteSelectedModelAdminMixin(object):
     """
     This mixin removes the delete_selected admin action from the
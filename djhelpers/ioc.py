@@ -12,9 +12,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import base64
+import collections
+import contextlib
+import contextvars
+import copy
+import functools
+import gc
+import hashlib
+import importlib
+import inspect
+import json
 import logging
+import operator
+import os
+import pickle
+import tempfile
+import threading
+import time
+import typing
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 logger = logging.getLogger(__name__)
 
+_PREFORKED_CONTEXTS = weakref.WeakSet()
+
+# The context scope stores of all application contexts by context. A
+# context variable is never freed while a context references it, so all
+# application contexts share this one. The dict is copied on change, as
+# the copies of a context, e.g. of asyncio tasks, share the value.
+_CONTEXT_SCOPES = contextvars.ContextVar('app_context_scopes', default=None)
+
+# guards the assignment of the resolved object of a LazyProxy
+_LAZY_PROXY_LOCK = threading.Lock()
+
+# Version of the pickled definitions in the compiled config cache. It
+# must be increased, whenever the attributes of ObjectDefinition, the
+# resolvers or the inject markers change.
+COMPILED_FORMAT_VERSION = 2
+
 
 class AppContextError(Exception):
     pass
@@ -27,11 +64,42 @@ class ObjectDefinitionNotFound(AppContextError):
     '''
 
 
+class CircularDependencyError(AppContextError):
+    '''
+    Raised when the object definitions depend on each other in a cycle.
+    '''
+
+    def __init__(self, cycle):
+        super(CircularDependencyError, self).__init__(
+            'Circular dependency: %s' % ' -> '.join(repr(c) for c in cycle))
+        self.cycle = cycle
+
+
+class ConfigurationError(AppContextError):
+    '''
+    Raised when a declarative configuration is invalid.
+    '''
+
+
+class FrozenContextError(AppContextError):
+    '''
+    Raised when a frozen application context should be changed.
+    '''
+
+
+class PoolTimeout(AppContextError):
+    '''
+    Raised when no pooled object becomes available in time.
+    '''
+
+
 class Inject(object):
     '''
     Marker to define a injection keyword argument.
     '''
 
+    lazy = False
+
     def __init__(self, object_id):
         '''
         Creates a new inject definition object
@@ -51,6 +119,292 @@ class Inject(object):
         '''
         return ioc_container.get(self.object_id)
 
+    async def aresolve(self, ioc_container):
+        '''
+        Injects the object with the defined object_id from the given
+        container, that may be created by an async factory.
+
+        :param ioc_container: The ioc container for the object look up
+        :type ioc_container: ApplicationContext
+        '''
+        return await ioc_container.aget(self.object_id)
+
+
+class LazyInject(Inject):
+    '''
+    Marker to define a lazy injection.
+
+    Instead of the object itself a LazyProxy is injected, that looks the
+    object up on first use. Objects that are never used are never
+    created.
+    '''
+
+    lazy = True
+
+    def __call__(self, ioc_container):
+        '''
+        Injects a proxy for the object with the defined object_id.
+
+        :param ioc_container: The ioc container for the object look up
+        :type ioc_container: ApplicationContext
+        '''
+        return LazyProxy(ioc_container, self.object_id)
+
+    async def aresolve(self, ioc_container):
+        # pylint: disable=missing-docstring
+        return self(ioc_container)
+
+
+def _proxy_method(func):
+    '''
+    Creates a LazyProxy method, that calls func with the resolved object.
+    '''
+    def inner(self, *args):  # pylint: disable=missing-docstring
+        return func(self._resolve(), *args)
+    return inner
+
+
+class LazyProxy(object):
+    '''
+    Proxy for an injected object, that is looked up in the container on
+    first use.
+
+    After the look up the proxy drops its container reference and
+    forwards everything to the resolved object. Threads, that use a new
+    proxy at the same time, may look the object up more than once, but
+    all of them get the object, that was stored first.
+    '''
+
+    __slots__ = ('_ioc_container', '_object_id', '_wrapped')
+
+    _UNRESOLVED = object()
+
+    def __init__(self, ioc_container, object_id):
+        object.__setattr__(self, '_ioc_container', ioc_container)
+        object.__setattr__(self, '_object_id', object_id)
+        object.__setattr__(self, '_wrapped', self._UNRESOLVED)
+
+    def _resolve(self):
+        '''
+        Returns the proxied object and looks it up, if necessary.
+        '''
+        wrapped = object.__getattribute__(self, '_wrapped')
+        if wrapped is not LazyProxy._UNRESOLVED:
+            return wrapped
+        ioc_container = object.__getattribute__(self, '_ioc_container')
+        if ioc_container is None:
+            # resolved by another thread in the meantime
+            return object.__getattribute__(self, '_wrapped')
+        wrapped = ioc_container.get(self._object_id)
+        with _LAZY_PROXY_LOCK:
+            resolved = object.__getattribute__(self, '_wrapped')
+            if resolved is not LazyProxy._UNRESOLVED:
+                return resolved
+            object.__setattr__(self, '_wrapped', wrapped)
+            object.__setattr__(self, '_ioc_container', None)
+        return wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._resolve(), name)
+
+    def __repr__(self):
+        if self._wrapped is LazyProxy._UNRESOLVED:
+            return '<LazyProxy for %r>' % (self._object_id,)
+        return repr(self._wrapped)
+
+    __class__ = property(_proxy_method(operator.attrgetter('__class__')))
+    __str__ = _proxy_method(str)
+    __bool__ = _proxy_method(bool)
+    __dir__ = _proxy_method(dir)
+    __hash__ = _proxy_method(hash)
+    __eq__ = _proxy_method(operator.eq)
+    __ne__ = _proxy_method(operator.ne)
+    __lt__ = _proxy_method(operator.lt)
+    __le__ = _proxy_method(operator.le)
+    __gt__ = _proxy_method(operator.gt)
+    __ge__ = _proxy_method(operator.ge)
+    __len__ = _proxy_method(len)
+    __iter__ = _proxy_method(iter)
+    __contains__ = _proxy_method(operator.contains)
+    __getitem__ = _proxy_method(operator.getitem)
+    __setitem__ = _proxy_method(operator.setitem)
+    __delitem__ = _proxy_method(operator.delitem)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __enter__(self):
+        return self._resolve().__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._resolve().__exit__(*exc_info)
+
+
+class _SequenceResolver(object):
+    '''
+    Resolution plan for a list, tuple or set argument.
+
+    The positions of the inject markers are recorded once, so resolving
+    the argument only has to fill in these slots.
+    '''
+
+    def __init__(self, items):
+        self.template = list(items)
+        self.slots = []
+        for index, item in enumerate(self.template):
+            resolver = _compile_arg(item)
+            if resolver is not None:
+                self.slots.append((index, resolver))
+
+    def __call__(self, ioc_container):
+        if not self.slots:
+            return self.template
+        value = list(self.template)
+        for index, resolver in self.slots:
+            value[index] = resolver(ioc_container)
+        return value
+
+    async def aresolve(self, ioc_container):
+        '''
+        Resolves all inject markers of the argument concurrently.
+        '''
+        if not self.slots:
+            return self.template
+        value = list(self.template)
+        results = await asyncio.gather(
+            *[resolver.aresolve(ioc_container) for _, resolver in self.slots])
+        for (index, _), result in zip(self.slots, results):
+            value[index] = result
+        return value
+
+
+class _DictResolver(object):
+    '''
+    Resolution plan for a dict argument.
+    '''
+
+    def __init__(self, items):
+        self.template = dict(items)
+        self.slots = []
+        for key, item in self.template.items():
+            resolver = _compile_arg(item)
+            if resolver is not None:
+                self.slots.append((key, resolver))
+
+    def __call__(self, ioc_container):
+        if not self.slots:
+            return self.template
+        value = dict(self.template)
+        for key, resolver in self.slots:
+            value[key] = resolver(ioc_container)
+        return value
+
+    async def aresolve(self, ioc_container):
+        '''
+        Resolves all inject markers of the argument concurrently.
+        '''
+        if not self.slots:
+            return self.template
+        value = dict(self.template)
+        results = await asyncio.gather(
+            *[resolver.aresolve(ioc_container) for _, resolver in self.slots])
+        for (key, _), result in zip(self.slots, results):
+            value[key] = result
+        return value
+
+
+def _compile_arg(arg):
+    '''
+    Compiles a factory argument into a resolver.
+
+    :param arg: the argument of an object definition
+    :type arg: object
+
+    :return: a callable that resolves the argument for a given container
+             or None, when the argument contains no inject marker and can
+             be passed on untouched.
+    :rtype: callable or None
+    '''
+    if isinstance(arg, Inject):
+        return arg
+    elif isinstance(arg, (list, tuple, set)):
+        resolver = _SequenceResolver(arg)
+    elif isinstance(arg, dict):
+        resolver = _DictResolver(arg)
+    else:
+        return None
+    return resolver if resolver.slots else None
+
+
+def _find_injects(arg):
+    '''
+    Returns all inject markers of a factory argument.
+
+    :param arg: the argument of an object definition
+    :type arg: object
+
+    :return: the inject markers
+    :rtype: list
+    '''
+    if isinstance(arg, Inject):
+        return [arg]
+    elif isinstance(arg, (list, tuple, set)):
+        return [i for a in arg for i in _find_injects(a)]
+    elif isinstance(arg, dict):
+        return [i for a in arg.values() for i in _find_injects(a)]
+    return []
+
+
+_AUTOWIRE_CACHE = {}
+
+
+def autowired_dependencies(factory):
+    '''
+    Returns the dependencies of a factory, that are declared by the type
+    annotations of its parameters.
+
+    Every annotated parameter without default value is a dependency on
+    the object id given by its annotation. The result is cached per
+    factory, because the signature introspection is slow.
+
+    :param factory: a class or function
+    :type factory: callable
+
+    :return: tuples of the position, name and object id of the parameters
+    :rtype: tuple
+    '''
+    try:
+        return _AUTOWIRE_CACHE[factory]
+    except KeyError:
+        pass
+    target = factory.load() if isinstance(factory, LazyFactory) else factory
+    signature = inspect.signature(target)
+    try:
+        hints = typing.get_type_hints(
+            target.__init__ if isinstance(target, type) else target)
+    except Exception:  # pylint: disable=broad-except
+        hints = {}
+    dependencies = []
+    for position, parameter in enumerate(signature.parameters.values()):
+        if parameter.kind not in (parameter.POSITIONAL_OR_KEYWORD,
+                                  parameter.KEYWORD_ONLY):
+            continue
+        if parameter.default is not parameter.empty:
+            continue
+        annotation = hints.get(parameter.name, parameter.annotation)
+        if annotation is parameter.empty:
+            continue
+        if parameter.kind == parameter.KEYWORD_ONLY:
+            position = None
+        dependencies.append((position, parameter.name, annotation))
+    return _AUTOWIRE_CACHE.setdefault(factory, tuple(dependencies))
+
 
 class ObjectDefinition(object):
     '''
@@ -61,9 +415,18 @@ class ObjectDefinition(object):
     SCOPE_PROTOTYPE = 'prototype'
     SCOPE_REQUEST = 'request'
     SCOPE_SESSION = 'session'
+    SCOPE_POOLED = 'pooled'
+    SCOPE_EXPIRING = 'expiring'
+    SCOPE_LRU = 'lru'
+    SCOPE_THREAD = 'thread'
+    SCOPE_CONTEXT = 'context'
+
+    OPTIONS = frozenset([
+        'dispose', 'pool_size', 'pool_timeout', 'pool_idle_timeout', 'ttl',
+        'refresh_ahead', 'fork_safe', 'autowire', 'session_codec', 'memoize'])
 
     def __init__(self, object_id, factory, args=None, kwargs=None, inject=None,
-                 scope=SCOPE_SINGLETON):
+                 scope=SCOPE_SINGLETON, **options):
         '''
         ObjectDefinition Constructor
 
@@ -75,212 +438,2527 @@ class ObjectDefinition(object):
         :type args: list
         :param kwargs: the kwargs for the object initialisation
         :type kwargs: dict
-        :param scope: scope of the defined object
-        :type scope: str
+        :param scope: scope of the defined object, True and False are
+                      accepted as singleton and prototype for backwards
+                      compatibility.
+        :type scope: str or bool
+        :param options: scope specific options:
+
+                        * dispose: callable or method name, that is called
+                          to free the resources of a discarded object
+                        * pool_size: max. number of pooled objects
+                          (default 10)
+                        * pool_timeout: seconds to wait for a pooled
+                          object (default None, waits forever)
+                        * pool_idle_timeout: seconds after that an idle
+                          pooled object is discarded (default None)
+                        * ttl: seconds an expiring object is cached
+                        * refresh_ahead: seconds before the expiry of an
+                          expiring object, when it is recreated in the
+                          background (default None)
+                        * fork_safe: False for objects, that must not be
+                          shared with forked processes, e.g. sockets,
+                          see ApplicationContext.prefork (default True)
+                        * autowire: injects the annotated parameters of
+                          the factory, that are not given by args or
+                          kwargs, see autowired_dependencies
+                        * memoize: max. number of prototypes created
+                          with runtime arguments, that are cached per
+                          argument tuple, see ApplicationContext.get
+                          (default None, no caching)
+
+        :raise TypeError: When a unknown option is given or a option
+                          required by the scope is missing
         '''
+        unknown = set(options) - self.OPTIONS
+        if unknown:
+            raise TypeError('Unknown options for "%s": %s'
+                            % (object_id, ', '.join(sorted(unknown))))
+        if scope == self.SCOPE_EXPIRING and not options.get('ttl'):
+            raise TypeError('The expiring object "%s" requires a ttl.'
+                            % object_id)
         self.object_id = object_id
         self.factory = factory
         self.args = list(args) if args else []
         self.kwargs = dict(kwargs) if kwargs else {}
+        if options.pop('autowire', False):
+            for position, name, dependency in autowired_dependencies(factory):
+                if position is not None and position < len(self.args):
+                    continue
+                self.kwargs.setdefault(name, Inject(dependency))
+        if scope is True:
+            scope = self.SCOPE_SINGLETON
+        elif scope is False:
+            scope = self.SCOPE_PROTOTYPE
         self.scope = scope
+        self.options = options
+        self.is_async = asyncio.iscoroutinefunction(factory)
+        self.compile()
 
+    def dispose(self, obj):
+        '''
+        Calls the dispose hook of the definition for the given object.
 
-class ApplicationContext(object):
-    '''
-    An IoC container to create defined objects.
-    '''
+        :param obj: a object created from this definition
+        :type obj: object
+        '''
+        hook = self.options.get('dispose')
+        if hook is None:
+            return
+        if isinstance(hook, str):
+            getattr(obj, hook)()
+        else:
+            hook(obj)
 
-    def __init__(self, config=None):
+    def compile(self):
         '''
-        Constructor
+        (Re)builds the resolution plan of the args and kwargs.
 
-        :param config: Initial configuration of the new
-                       application context object
-        :type config: tuple or list
+        Must be called again, when args or kwargs are changed after the
+        construction of the definition.
         '''
-        logger.info('Creating new app context object')
-        self._config = {}
-        self._singeltons = {}
-        if config:
-            self.load_config(config)
+        self._args_plan = _SequenceResolver(self.args)
+        self._kwargs_plan = _DictResolver(self.kwargs)
+        self.injects = _find_injects(self.args) + _find_injects(self.kwargs)
+        self._injected_parameters = None
 
-    def load_config(self, config):
-        for c in config:
-            self.register(*c)
+    def injected_parameters(self):
+        '''
+        Returns the inject markers, that are passed directly as argument
+        to the factory, by parameter name. The names of positional args
+        are taken from the signature of the factory.
 
-    def register(self, object_id, factory, args=None, kwargs=None,
-                 inject=None, singelton=True):
+        :rtype: dict
         '''
-        Registers an implementation class for the given interface.
-        The interface is normally a python abc class.
+        parameters = self._injected_parameters
+        if parameters is None:
+            parameters = dict((name, arg) for name, arg in self.kwargs.items()
+                              if isinstance(arg, Inject))
+            if any(isinstance(arg, Inject) for arg in self.args):
+                factory = self.factory
+                if isinstance(factory, LazyFactory):
+                    factory = factory.load()
+                try:
+                    names = [p.name for p in
+                             inspect.signature(factory).parameters.values()
+                             if p.kind in (p.POSITIONAL_ONLY,
+                                           p.POSITIONAL_OR_KEYWORD)]
+                except (TypeError, ValueError):
+                    names = []
+                for name, arg in zip(names, self.args):
+                    if isinstance(arg, Inject):
+                        parameters[name] = arg
+            self._injected_parameters = parameters
+        return parameters
 
-        :param object_id: the interface of the implementation
-        :type object_id: object
-        :param factory: factory of the object
-        :type factory: callable or type or func
-        :param args: the args for the object factory
-        :type args: tuple, list or None
-        :param kwargs: the kwargs for the object factory
-        :type kwargs: dict or None
-        :param inject: the interface of the implemetations that should
-                       be injected as a keyword argument.
-        :type inject: dict or None
+    @property
+    def dependencies(self):
         '''
-        logger.info('Registered new object definition: %s', object_id)
-        self._config[object_id] = ObjectDefinition(
-            object_id, factory, args, kwargs, inject, singelton)
+        The object ids that have to be created together with this object.
 
-    def reset(self):
+        Lazy injections are not included, they are created on first use.
         '''
-        Resets the configuration and the singleton cache of the
-        container.
+        return set(i.object_id for i in self.injects if not i.lazy)
+
+    def resolve_arguments(self, ioc_container):
         '''
-        logger.info('Reseting application context')
-        self._config.clear()
-        self._singeltons.clear()
+        Resolves the args and kwargs of the factory call.
 
-    def _eval_arg(self, arg):
-        # TODO: Improve the return type
-        if isinstance(arg, Inject):
-            return arg(self)
-        elif isinstance(arg, (list, tuple, set)):
-            return [self._eval_arg(a) for a in arg]
-        elif isinstance(arg, dict):
-            return dict((k, self._eval_arg(arg[k])) for k in arg)
-        else:
-            return arg
+        Arguments without inject markers are reused untouched.
 
-    def _create(self, object_def):
-        '''
-        Creates a object for the configured concrete interface
-        implementation.
+        :param ioc_container: The ioc container for the object look up
+        :type ioc_container: ApplicationContext
 
-        :param object_def: the configuration for the new object
-        :type object_def: ObjectDefinition
+        :return: the args and kwargs for the factory
+        :rtype: tuple
+        '''
+        return self._args_plan(ioc_container), \
+            self._kwargs_plan(ioc_container)
 
-        :return: a new object of the configured class.
-        :rtype: object
+    async def aresolve_arguments(self, ioc_container):
         '''
-        logger.debug('Creating new instance of: %s', object_def)
-        impl_class = object_def.factory
-        args = self._eval_arg(object_def.args)
-        kwargs = self._eval_arg(object_def.kwargs)
-        return impl_class(*args, **kwargs)
+        Resolves the args and kwargs of the factory call with
+        ApplicationContext.aget. Independent inject markers are resolved
+        concurrently.
 
-    def get(self, object_id):
+        :param ioc_container: The ioc container for the object look up
+        :type ioc_container: ApplicationContext
+
+        :return: the args and kwargs for the factory
+        :rtype: tuple
         '''
-        Returns the configured object with the given object_id.
+        return tuple(await asyncio.gather(
+            self._args_plan.aresolve(ioc_container),
+            self._kwargs_plan.aresolve(ioc_container)))
 
-        :param object_id: the identifier of the requested object
-        :type object_id: object or type
 
-        :return: a object that has the requested object_id
-        :rtype: object
+class LazyFactory(object):
+    '''
+    A factory referenced by its dotted path, that is imported on the
+    first call.
+    '''
 
-        :raise ObjectDefinitionNotFound: When no definition is found
+    def __init__(self, path):
         '''
-        logger.debug('Quering object: %s', object_id)
-        if object_id in self._singeltons:
-            logger.debug('Found object "%s" in the singleton cache', object_id)
-            return self._singeltons[object_id]
+        Constructor
 
-        object_def = self._get_object_def(object_id)
-        obj = self._create(object_def)
+        :param path: the dotted path, e.g. ``myapp.services.Mailer``
+        :type path: str
+        '''
+        self.path = path
+        self._target = None
 
-        if object_def.scope == ObjectDefinition.SCOPE_SINGLETON:
-            logger.debug('Adding "%s" to the singleton cache', object_id)
-            self._singeltons[object_id] = obj
-        return obj
+    def load(self):
+        '''
+        Imports and returns the referenced factory.
 
-    def get_scope(self, object_id):
+        :raise ConfigurationError: When the factory cannot be imported
         '''
-        Returns the scope of the object with the given id.
+        target = self._target
+        if target is None:
+            module_name, _, name = self.path.rpartition('.')
+            try:
+                target = getattr(importlib.import_module(module_name), name)
+            except (ImportError, AttributeError, ValueError) as e:
+                raise ConfigurationError(
+                    'Cannot import factory "%s": %s' % (self.path, e))
+            self._target = target
+        return target
 
-        :param object_id: the object id
-        :type object_id: object or type
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
 
-        :return: the scope of the object
-        :rtype: object
+    def __getstate__(self):
+        return {'path': self.path}
 
-        :raise ObjectDefinitionNotFound: When no definition is found
-        '''
-        return self._get_object_def(object_id).scope
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._target = None
 
-    def _get_object_def(self, object_id):
-        '''
-        Returns the object definition for the given id.
+    def __repr__(self):
+        return '<LazyFactory %s>' % self.path
 
-        :param object_id: the object id
-        :type object_id: object or type
 
-        :return: the object defintion
-        :rtype: ObjectDefintion
+def _decode_arg(arg):
+    '''
+    Replaces the ``{"inject": id}`` and ``{"inject": id, "lazy": true}``
+    dicts of a declarative argument by inject markers.
+    '''
+    if isinstance(arg, dict):
+        if 'inject' in arg:
+            marker = LazyInject if arg.get('lazy') else Inject
+            return marker(arg['inject'])
+        return dict((k, _decode_arg(v)) for k, v in arg.items())
+    elif isinstance(arg, list):
+        return [_decode_arg(a) for a in arg]
+    return arg
 
-        :raise ObjectDefinitionNotFound: When no definition is found
-        '''
-        try:
-            return self._config[object_id]
-        except KeyError:
-            raise ObjectDefinitionNotFound(
-                'No defintion for "%s" found.' % object_id)
 
+def parse_config(entries):
+    '''
+    Creates object definitions from a declarative configuration.
 
-class RequestApplicationContext(object):
+    Every entry is a dict with the keys id, factory, args, kwargs and
+    scope. All other keys are passed on as options. Factories are given
+    as dotted path and imported on first use. Dependencies are written
+    as ``{"inject": "object_id"}``, lazy ones as
+    ``{"inject": "object_id", "lazy": true}``.
+
+    :param entries: the declarative configuration
+    :type entries: list
+
+    :return: the object definitions
+    :rtype: list
+
+    :raise ConfigurationError: When a entry is invalid
     '''
-    Extends the application context with session and request scope
-    support.
+    definitions = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ConfigurationError('Invalid object definition: %r' % entry)
+        entry = dict(entry)
+        try:
+            object_id = entry.pop('id')
+            factory = entry.pop('factory')
+        except KeyError as e:
+            raise ConfigurationError(
+                'Object definition %r misses the key %s' % (entry, e))
+        if isinstance(factory, str):
+            factory = LazyFactory(factory)
+        kwargs = entry.pop('kwargs', None) or {}
+        try:
+            definitions.append(ObjectDefinition(
+                object_id, factory, _decode_arg(entry.pop('args', None)),
+                dict((k, _decode_arg(v)) for k, v in kwargs.items()), None,
+                entry.pop('scope', ObjectDefinition.SCOPE_SINGLETON),
+                **entry))
+        except TypeError as e:
+            raise ConfigurationError(str(e))
+    return definitions
+
+
+class ObjectPool(object):
     '''
+    A bounded pool of reusable objects.
 
-    SESSION_KEY = 'app_context_store'
+    Objects are checked out for exclusive use and returned afterwards.
+    New objects are created on demand until max_size is reached, then
+    checkout blocks until an object is returned. Idle objects are
+    discarded after idle_timeout seconds.
 
-    def __init__(self, application_context, request):
-        self._app_context = application_context
-        self.request = request
-        self._request_store = {}
+    Usage:
 
-    def _get_session_store(self):
-        if self.SESSION_KEY not in self.request.session:
-            self.request[self.SESSION_KEY] = dict()
-        return self.request[self.SESSION_KEY]
+    >>> with pool.item() as client:
+    ...     client.query()
+    '''
 
-    def _get_request_store(self):
-        return self._request_store
+    _DEFAULT = object()
 
-    def _add_to_store(self, object_id, obj):
-        scope = self._app_context.get_scope(object_id)
-        if scope == ObjectDefinition.SCOPE_REQUEST:
-            self._get_request_store()[object_id] = obj
-        elif scope == ObjectDefinition.SCOPE_SESSION:
-            self._get_session_store()[object_id] = obj
+    def __init__(self, factory, max_size=10, timeout=None,
+                 idle_timeout=None, dispose=None):
+        '''
+        Creates a new pool
 
-    def get(self, object_id):
+        :param factory: creates a new object for the pool
+        :type factory: callable
+        :param max_size: max. number of objects
+        :type max_size: int
+        :param timeout: default seconds to wait in checkout,
+                        None waits forever
+        :type timeout: float or None
+        :param idle_timeout: seconds after that idle objects are discarded
+        :type idle_timeout: float or None
+        :param dispose: called with every discarded object
+        :type dispose: callable or None
         '''
-        Returns the configured object with the given object_id.
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._factory = factory
+        self._dispose = dispose
+        self._condition = threading.Condition()
+        self._idle = collections.deque()
+        self._size = 0
+        self._created = 0
+        self._disposed = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
 
-        :param object_id: the identifier of the requested object
-        :type object_id: object
+    def checkout(self, timeout=_DEFAULT):
+        '''
+        Takes a object out of the pool.
 
-        :return: a object that has the requested object_id
+        :param timeout: seconds to wait for a free object,
+                        defaults to the timeout of the pool
+        :type timeout: float or None
+
+        :return: a object for exclusive use
         :rtype: object
-        '''
-        for store in [self._get_request_store(), self._get_session_store()]:
-            if object_id in store:
-                return store[object_id]
 
-        obj = self._app_context.get(object_id)
-        self._add_to_store(object_id, obj)
+        :raise PoolTimeout: When no object became available in time
+        '''
+        if timeout is self._DEFAULT:
+            timeout = self.timeout
+        with self._condition:
+            evicted = self._evict_idle()
+            started = None
+            while not self._idle and self._size >= self.max_size:
+                now = time.time()
+                if started is None:
+                    started = now
+                    self._waits += 1
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (now - started)
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._record_wait(now - started)
+                        raise PoolTimeout(
+                            'No pooled object available after %ss' % timeout)
+                self._condition.wait(remaining)
+            if started is not None:
+                self._record_wait(time.time() - started)
+            self._checkouts += 1
+            obj = self._idle.pop()[0] if self._idle else self._DEFAULT
+            if obj is self._DEFAULT:
+                self._size += 1
+        self._dispose_all(evicted)
+        if obj is self._DEFAULT:
+            try:
+                obj = self._factory()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+            with self._condition:
+                self._created += 1
         return obj
 
+    def checkin(self, obj):
+        '''
+        Returns a checked out object to the pool.
 
-class ApplicationContextMiddleware(object):
-    """
-    Middleware that sets `app_context` attribute to request object.
-    """
+        :param obj: the checked out object
+        :type obj: object
+        '''
+        with self._condition:
+            self._idle.append((obj, time.time()))
+            self._condition.notify()
 
-    def __init__(self):
-        self._app_context = ApplicationContext()  # TODO: Load config
+    def discard(self, obj):
+        '''
+        Disposes a checked out object instead of returning it, e.g.
+        because it is broken.
+
+        :param obj: the checked out object
+        :type obj: object
+        '''
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+        self._dispose_all([obj])
+
+    @contextlib.contextmanager
+    def item(self, timeout=_DEFAULT):
+        '''
+        Context manager that checks out a object and returns it at the
+        end of the block.
 
-    def process_request(self, request):
-        def _get(object_id):
-            return self._app_context.get(object_id)
-        request.app_context = _get
+        :param timeout: seconds to wait for a free object
+        :type timeout: float or None
+        '''
+        obj = self.checkout(timeout)
+        try:
+            yield obj
+        finally:
+            self.checkin(obj)
+
+    def evict_idle(self):
+        '''
+        Discards all objects that are idle for longer than idle_timeout.
+        '''
+        with self._condition:
+            evicted = self._evict_idle()
+        self._dispose_all(evicted)
+
+    def _evict_idle(self):
+        '''
+        Removes the expired idle objects, the lock must be held.
+
+        :return: the removed objects
+        :rtype: list
+        '''
+        evicted = []
+        if self.idle_timeout is None:
+            return evicted
+        deadline = time.time() - self.idle_timeout
+        while self._idle and self._idle[0][1] < deadline:
+            evicted.append(self._idle.popleft()[0])
+            self._size -= 1
+        if evicted:
+            self._condition.notify(len(evicted))
+        return evicted
+
+    def _dispose_all(self, objects):
+        # pylint: disable=missing-docstring
+        if not objects:
+            return
+        with self._condition:
+            self._disposed += len(objects)
+        if self._dispose is not None:
+            for obj in objects:
+                self._dispose(obj)
+
+    def _record_wait(self, wait_time):
+        # pylint: disable=missing-docstring
+        self._wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+
+    def stats(self):
+        '''
+        Returns the occupancy and wait time statistics of the pool.
+
+        :rtype: dict
+        '''
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'created': self._created,
+                'disposed': self._disposed,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time': self._wait_time,
+                'max_wait_time': self._max_wait_time,
+            }
+
+
+def _dispose_objects(objects):
+    # pylint: disable=missing-docstring
+    for object_def, obj in objects:
+        try:
+            object_def.dispose(obj)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Disposing "%s" failed', object_def.object_id)
+
+
+class _ScopeStore(object):
+    '''
+    The objects of one thread or context. They are disposed when the
+    store is garbage collected, i.e. when the thread or context ends.
+
+    The generation of the application context, that created the store,
+    is recorded, so stores created before a reset are replaced.
+    '''
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.objects = {}
+        self._created = []
+        self.dispose = weakref.finalize(self, _dispose_objects, self._created)
+
+    def add(self, object_def, obj):
+        # pylint: disable=missing-docstring
+        self.objects[object_def.object_id] = obj
+        self._created.append((object_def, obj))
+
+
+class _LazyState(object):
+    '''
+    Descriptor for instance state, that is created on first access.
+
+    The created value is stored in the instance dict, where it shadows
+    the descriptor, so later accesses cost as much as a plain attribute.
+    When threads race for the creation, all get the value of the first.
+    '''
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.__dict__.setdefault(self.name, self.factory())
+
+
+class ApplicationContext(object):
+    '''
+    An IoC container to create defined objects.
+
+    Besides singletons and prototypes it supports:
+
+    * pooled objects, see ObjectPool
+    * expiring objects, that are cached for the ttl option. With the
+      refresh_ahead option they are recreated in the background before
+      they expire and the cached object is returned until the new one is
+      ready.
+    * lru objects, of which the lru_size most recently used ones are
+      cached.
+    * thread objects, that are created once per thread
+    * context objects, that are created once per contextvars context,
+      e.g. per asyncio task. Like every context variable, the objects
+      are inherited by tasks that are started after their creation, see
+      context_scope to start a new scope explicitly.
+
+    Thread and context objects are disposed when their thread or context
+    is garbage collected.
+    '''
+
+    lru_size = 128
+
+    _frozen = False
+    _stats = None
+    _refresh_executor = None
+    _dependents_cache = None
+    _scope_generation = 0
+    _frozen_contexts = None
+
+    # the state of the less common scopes is created on first use, so
+    # contexts that do not use them stay small
+    _pending_singletons = _LazyState(dict)
+    _expiring = _LazyState(dict)
+    _refreshing = _LazyState(set)
+    _refresh_lock = _LazyState(threading.Lock)
+    _lru = _LazyState(collections.OrderedDict)
+    _lru_lock = _LazyState(threading.Lock)
+    _memoized = _LazyState(dict)
+    _memoize_lock = _LazyState(threading.Lock)
+    _thread_scope = _LazyState(threading.local)
+
+    def __init__(self, config=None):
+        '''
+        Constructor
+
+        :param config: Initial configuration of the new
+                       application context object
+        :type config: tuple or list
+        '''
+        logger.info('Creating new app context object')
+        self._config = {}
+        self._singeltons = {}
+        self._singleton_locks = {}
+        if config:
+            self.load_config(config)
+
+    def load_config(self, config, validate=True):
+        '''
+        Registers all object definitions of the given config.
+
+        :param config: tuples with the arguments for register
+        :type config: tuple or list
+        :param validate: checks the dependencies of all registered
+                         definitions after loading the config
+        :type validate: bool
+
+        :raise ObjectDefinitionNotFound: When a dependency is not defined
+        :raise CircularDependencyError: When the definitions depend on
+                                        each other in a cycle
+        '''
+        for c in config:
+            self.register(*c)
+        if validate:
+            self.validate()
+
+    def load_definitions(self, definitions, validate=True):
+        '''
+        Adds the given object definitions.
+
+        :param definitions: the object definitions
+        :type definitions: list
+        :param validate: checks the dependencies of all registered
+                         definitions after loading them
+        :type validate: bool
+
+        :raise ObjectDefinitionNotFound: When a dependency is not defined
+        :raise CircularDependencyError: When the definitions depend on
+                                        each other in a cycle
+        '''
+        for object_def in definitions:
+            self._add_definition(object_def)
+        if validate:
+            self.validate()
+
+    def load_json_config(self, path, cache_dir=None):
+        '''
+        Loads a declarative configuration from a JSON file, see
+        parse_config.
+
+        With a cache_dir, the validated definitions are cached in a file
+        named after the hash of the JSON file. Later loads of an unchanged
+        file skip parsing and validation.
+
+        :param path: path of the JSON file with a list of entries
+        :type path: str
+        :param cache_dir: directory for the compiled configuration
+        :type cache_dir: str or None
+        '''
+        with open(path, 'rb') as config_file:
+            data = config_file.read()
+        self._load_compiled(lambda: json.loads(data.decode('utf-8')),
+                            hashlib.sha256(data).hexdigest(), cache_dir)
+
+    def load_declarative_config(self, entries, cache_dir=None):
+        '''
+        Loads a declarative configuration, see parse_config.
+
+        The compiled definitions are cached like in load_json_config,
+        when the entries are JSON serializable.
+
+        :param entries: the declarative configuration
+        :type entries: list
+        :param cache_dir: directory for the compiled configuration
+        :type cache_dir: str or None
+        '''
+        cache_key = None
+        if cache_dir:
+            try:
+                cache_key = hashlib.sha256(json.dumps(
+                    entries, sort_keys=True).encode('utf-8')).hexdigest()
+            except (TypeError, ValueError):
+                pass
+        self._load_compiled(lambda: entries, cache_key, cache_dir)
+
+    def load_settings_config(self, settings=None):
+        '''
+        Loads the declarative configuration of the django settings.
+
+        APP_CONTEXT_CONFIG is either a list of entries, see parse_config,
+        or the path to a JSON file with them. APP_CONTEXT_CACHE_DIR sets
+        the directory for the compiled configuration.
+
+        :param settings: the settings, defaults to django.conf.settings
+        :type settings: object
+        '''
+        if settings is None:
+            from django.conf import settings
+        config = getattr(settings, 'APP_CONTEXT_CONFIG', None)
+        cache_dir = getattr(settings, 'APP_CONTEXT_CACHE_DIR', None)
+        if not config:
+            return
+        if isinstance(config, str):
+            self.load_json_config(config, cache_dir)
+        else:
+            self.load_declarative_config(config, cache_dir)
+
+    def _load_compiled(self, load_entries, cache_key, cache_dir):
+        '''
+        Loads the compiled definitions from the cache or parses,
+        validates and caches them.
+        '''
+        cache_file = None
+        if cache_dir and cache_key:
+            cache_file = os.path.join(
+                cache_dir, 'app_context_v%d_%s.pickle'
+                % (COMPILED_FORMAT_VERSION, cache_key))
+            try:
+                with open(cache_file, 'rb') as compiled:
+                    definitions = pickle.load(compiled)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            else:
+                logger.info('Loaded compiled configuration %s', cache_file)
+                self.load_definitions(definitions, validate=False)
+                return
+        definitions = parse_config(load_entries())
+        self.load_definitions(definitions)
+        if cache_file is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+                with os.fdopen(fd, 'wb') as compiled:
+                    pickle.dump(definitions, compiled,
+                                pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_file)
+            except OSError:
+                logger.warning('Cannot write compiled configuration %s',
+                               cache_file, exc_info=True)
+
+    def dependency_graph(self):
+        '''
+        Returns the dependencies of all registered object definitions.
+
+        :return: the object ids mapped to the ids they depend on
+        :rtype: dict
+        '''
+        return dict((object_id, object_def.dependencies)
+                    for object_id, object_def in self._definitions().items())
+
+    def validate(self):
+        '''
+        Checks that all dependencies are defined and free of cycles.
+
+        :raise ObjectDefinitionNotFound: When a dependency is not defined
+        :raise CircularDependencyError: When the definitions depend on
+                                        each other in a cycle
+        '''
+        self._dependency_levels()
+
+    def _dependency_levels(self):
+        '''
+        Sorts the object ids topologically.
+
+        :return: lists of object ids, every id only depends on ids of
+                 the previous lists.
+        :rtype: list
+
+        :raise ObjectDefinitionNotFound: When a dependency is not defined
+        :raise CircularDependencyError: When the definitions depend on
+                                        each other in a cycle
+        '''
+        graph = self.dependency_graph()
+        for object_id, object_def in self._definitions().items():
+            for inject in object_def.injects:
+                if inject.object_id not in graph:
+                    raise ObjectDefinitionNotFound(
+                        'No defintion for "%s" found, required by "%s".'
+                        % (inject.object_id, object_id))
+        return _topological_levels(graph)
+
+    def _dependents(self):
+        '''
+        Returns the ids of the definitions, that inject a object, by the
+        id of the object. Lazy injections are included. The map is cached
+        until the definitions change.
+
+        :rtype: dict
+        '''
+        dependents = self._dependents_cache
+        if dependents is None:
+            dependents = {}
+            for object_id, object_def in self._definitions().items():
+                for inject in object_def.injects:
+                    dependents.setdefault(inject.object_id, []).append(
+                        object_id)
+            self._dependents_cache = dependents
+        return dependents
+
+    def warm_up(self, parallel=None, exclude=()):
+        '''
+        Creates all singletons in dependency order.
+
+        :param parallel: number of threads that create independent
+                         singletons at the same time
+        :type parallel: int or None
+        :param exclude: ids of singletons, that should not be created
+        :type exclude: set
+
+        :raise ObjectDefinitionNotFound: When a dependency is not defined
+        :raise CircularDependencyError: When the definitions depend on
+                                        each other in a cycle
+        '''
+        logger.info('Warming up application context')
+        levels = [[object_id for object_id in level
+                   if self._get_object_def(object_id).scope ==
+                   ObjectDefinition.SCOPE_SINGLETON and
+                   object_id not in exclude]
+                  for level in self._dependency_levels()]
+        if not parallel or parallel < 2:
+            for level in levels:
+                for object_id in level:
+                    self.get(object_id)
+            return
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for level in levels:
+                list(executor.map(self.get, level))
+
+    def prefork(self, parallel=None):
+        '''
+        Prepares the context in the master process of a pre-fork server.
+
+        All singletons are created and moved to the permanent generation
+        of the garbage collector with gc.freeze, so the forked workers
+        share them copy-on-write instead of creating them again.
+
+        Definitions with the option fork_safe=False, and all singletons
+        that depend on them, are not created. If they were created
+        anyway, they are dropped in the forked processes and created
+        again on first use.
+
+        :param parallel: number of threads that create independent
+                         singletons at the same time
+        :type parallel: int or None
+        '''
+        self.warm_up(parallel, exclude=self._fork_unsafe_ids())
+        if not _PREFORKED_CONTEXTS and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_reset_preforked_contexts)
+        _PREFORKED_CONTEXTS.add(self)
+        gc.collect()
+        gc.freeze()
+
+    def _fork_unsafe_ids(self):
+        '''
+        Returns the ids of the fork unsafe definitions and of all
+        definitions, that depend on them.
+        '''
+        dependents = {}
+        unsafe = []
+        for object_id, object_def in self._definitions().items():
+            if not object_def.options.get('fork_safe', True):
+                unsafe.append(object_id)
+            for dependency in object_def.dependencies:
+                dependents.setdefault(dependency, []).append(object_id)
+        result = set()
+        while unsafe:
+            object_id = unsafe.pop()
+            if object_id not in result:
+                result.add(object_id)
+                unsafe.extend(dependents.get(object_id, ()))
+        return result
+
+    def _reset_after_fork(self):
+        '''
+        Drops the locks, the background refresh and the fork unsafe
+        objects and pools inherited by a forked process.
+        '''
+        self._singleton_locks = {}
+        self._pending_singletons = {}
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = None
+        self._lru_lock = threading.Lock()
+        self._memoize_lock = threading.Lock()
+        unsafe = self._fork_unsafe_ids()
+        for object_id in list(self._singeltons):
+            if object_id in unsafe or isinstance(
+                    self._singeltons[object_id], ObjectPool):
+                del self._singeltons[object_id]
+        for object_id in unsafe:
+            self._expiring.pop(object_id, None)
+            self._lru.pop(object_id, None)
+            self._memoized.pop(object_id, None)
+        for frozen in list(self._frozen_contexts or ()):
+            frozen._reset_after_fork()
+
+    def register(self, object_id, factory, args=None, kwargs=None,
+                 inject=None, scope=ObjectDefinition.SCOPE_SINGLETON,
+                 **options):
+        '''
+        Registers an implementation class for the given interface.
+        The interface is normally a python abc class.
+
+        :param object_id: the interface of the implementation
+        :type object_id: object
+        :param factory: factory of the object
+        :type factory: callable or type or func
+        :param args: the args for the object factory
+        :type args: tuple, list or None
+        :param kwargs: the kwargs for the object factory
+        :type kwargs: dict or None
+        :param inject: the interface of the implemetations that should
+                       be injected as a keyword argument.
+        :type inject: dict or None
+        :param scope: the scope of the object, see ObjectDefinition
+        :type scope: str or bool
+        :param options: scope specific options, see ObjectDefinition. The
+                        old singelton flag is accepted instead of scope.
+
+        :raise TypeError: When a unknown option is given
+        '''
+        if 'singelton' in options:
+            scope = options.pop('singelton')
+        logger.debug('Registered new object definition: %s', object_id)
+        self._add_definition(ObjectDefinition(
+            object_id, factory, args, kwargs, inject, scope, **options))
+
+    def _add_definition(self, object_def):
+        '''
+        Adds or replaces a object definition.
+
+        :param object_def: the object definition
+        :type object_def: ObjectDefinition
+
+        :raise FrozenContextError: When the context is frozen
+        '''
+        if self._frozen:
+            raise FrozenContextError(
+                'Cannot register "%s", the context is frozen.'
+                % object_def.object_id)
+        self._config[object_def.object_id] = object_def
+        self._dependents_cache = None
+
+    def reset(self):
+        '''
+        Resets the configuration and the singleton cache of the
+        container.
+
+        :raise FrozenContextError: When the context is frozen
+        '''
+        if self._frozen:
+            raise FrozenContextError('Cannot reset a frozen context.')
+        logger.info('Reseting application context')
+        self._config.clear()
+        self._dependents_cache = None
+        self._singeltons.clear()
+        self._singleton_locks.clear()
+        with self._refresh_lock:
+            self._expiring.clear()
+        with self._lru_lock:
+            self._lru.clear()
+        with self._memoize_lock:
+            self._memoized.clear()
+        # the stores of other threads and contexts are replaced on their
+        # next use
+        self._scope_generation += 1
+        self.end_thread_scope()
+        store = self._get_context_store()
+        if store is not None:
+            self._set_context_store(None)
+            store.dispose()
+        if self._stats is not None:
+            self.reset_stats()
+
+    def freeze(self):
+        '''
+        Compiles the context into a FrozenApplicationContext for fast
+        lookups by handle. Afterwards the context rejects new definitions.
+
+        :rtype: FrozenApplicationContext
+        '''
+        self.validate()
+        self._frozen = True
+        frozen = FrozenApplicationContext(self)
+        if self._frozen_contexts is None:
+            self._frozen_contexts = weakref.WeakSet()
+        self._frozen_contexts.add(frozen)
+        return frozen
+
+    def child(self, config=None):
+        '''
+        Creates a child context, that inherits the definitions and
+        singletons of this context, see ChildApplicationContext.
+
+        :param config: the overriding definitions of the child
+        :type config: tuple or list
+
+        :rtype: ChildApplicationContext
+        '''
+        return ChildApplicationContext(self, config)
+
+    def _definitions(self):
+        '''
+        Returns all object definitions of the context.
+
+        :return: the object definitions by id
+        :rtype: dict
+        '''
+        return self._config
+
+    def enable_stats(self):
+        '''
+        Starts recording per object id statistics, see stats().
+
+        The instrumented methods shadow get and the create methods on the
+        instance, so a container without stats runs the plain methods.
+        '''
+        if self._stats is not None:
+            return
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.get = self._instrumented_get
+        self._create = self._instrumented_create
+        self._acreate = self._instrumented_acreate
+
+    def disable_stats(self):
+        '''
+        Stops recording statistics and drops the recorded ones.
+        '''
+        if self._stats is None:
+            return
+        del self.get, self._create, self._acreate
+        self._stats = None
+
+    def reset_stats(self):
+        '''
+        Drops the recorded statistics.
+        '''
+        if self._stats is not None:
+            self._stats = {}
+
+    def stats(self):
+        '''
+        Returns the recorded statistics per object id:
+
+        * hits: lookups served by the singleton cache
+        * misses: singleton lookups that had to create the object
+        * created: number of created instances
+        * total_time, max_time: seconds spent in the creation, including
+          the creation of the dependencies
+
+        Hits are counted without locking and may be slightly off under
+        heavy concurrency.
+
+        :return: the statistics or an empty dict, if stats are disabled
+        :rtype: dict
+        '''
+        if self._stats is None:
+            return {}
+        return dict((object_id, dict(stats))
+                    for object_id, stats in list(self._stats.items()))
+
+    def _get_stats(self, object_id):
+        # pylint: disable=missing-docstring
+        try:
+            return self._stats[object_id]
+        except KeyError:
+            return self._stats.setdefault(object_id, {
+                'hits': 0, 'misses': 0, 'created': 0,
+                'total_time': 0.0, 'max_time': 0.0})
+
+    def _instrumented_get(self, object_id, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        if object_id in self._singeltons:
+            self._get_stats(object_id)['hits'] += 1
+        else:
+            # raises for unknown ids before a stats entry is created
+            scope = self.get_scope(object_id)
+            stats = self._get_stats(object_id)
+            if scope == ObjectDefinition.SCOPE_SINGLETON:
+                stats['misses'] += 1
+        return type(self).get(self, object_id, *args, **kwargs)
+
+    def _record_creation(self, object_id, elapsed):
+        # pylint: disable=missing-docstring
+        with self._stats_lock:
+            stats = self._get_stats(object_id)
+            stats['created'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def _instrumented_create(self, object_def, ioc_container=None,
+                             *runtime_arguments):
+        # pylint: disable=missing-docstring
+        started = time.perf_counter()
+        obj = type(self)._create(self, object_def, ioc_container,
+                                 *runtime_arguments)
+        self._record_creation(object_def.object_id,
+                              time.perf_counter() - started)
+        return obj
+
+    async def _instrumented_acreate(self, object_def):
+        # pylint: disable=missing-docstring
+        started = time.perf_counter()
+        obj = await type(self)._acreate(self, object_def)
+        self._record_creation(object_def.object_id,
+                              time.perf_counter() - started)
+        return obj
+
+    @contextlib.contextmanager
+    def trace(self):
+        '''
+        Context manager, that records all object creations inside the
+        block with a ResolutionTracer.
+
+        Usage:
+
+        >>> with app_context.trace() as tracer:
+        ...     app_context.get('service')
+        >>> print(tracer.collapsed_stacks())
+        '''
+        tracer = ResolutionTracer()
+        previous = vars(self).get('_create')
+        traced = self._create = tracer.wrap(self._create)
+        try:
+            yield tracer
+        finally:
+            # enable_stats or disable_stats in the block replace the
+            # traced method, their method is kept
+            if vars(self).get('_create') is traced:
+                if previous is None:
+                    del self._create
+                else:
+                    self._create = previous
+
+    def _create(self, object_def, ioc_container=None, runtime_args=(),
+                runtime_kwargs=None):
+        '''
+        Creates a object for the configured concrete interface
+        implementation.
+
+        :param object_def: the configuration for the new object
+        :type object_def: ObjectDefinition
+        :param ioc_container: the container to look up the dependencies,
+                              defaults to this context
+        :type ioc_container: object
+        :param runtime_args: args appended to the configured args
+        :type runtime_args: tuple
+        :param runtime_kwargs: kwargs, that override the configured ones
+        :type runtime_kwargs: dict or None
+
+        :return: a new object of the configured class.
+        :rtype: object
+        '''
+        if object_def.is_async:
+            raise AppContextError(
+                'The factory of "%s" is a coroutine, use aget() instead.'
+                % object_def.object_id)
+        if ioc_container is None:
+            ioc_container = self
+        args, kwargs = object_def.resolve_arguments(ioc_container)
+        if runtime_args:
+            args = list(args) + list(runtime_args)
+        if runtime_kwargs:
+            kwargs = dict(kwargs, **runtime_kwargs)
+        return object_def.factory(*args, **kwargs)
+
+    async def _acreate(self, object_def):
+        '''
+        Creates a object for the configured concrete interface
+        implementation, that may have an async factory.
+
+        :param object_def: the configuration for the new object
+        :type object_def: ObjectDefinition
+
+        :return: a new object of the configured class.
+        :rtype: object
+        '''
+        args, kwargs = await object_def.aresolve_arguments(self)
+        obj = object_def.factory(*args, **kwargs)
+        if inspect.isawaitable(obj):
+            obj = await obj
+        return obj
+
+    def get(self, object_id, *args, **kwargs):
+        '''
+        Returns the configured object with the given object_id.
+
+        Prototypes accept runtime arguments: args are appended to the
+        configured args and kwargs override the configured kwargs. With
+        the memoize option the objects are cached per argument tuple.
+
+        :param object_id: the identifier of the requested object
+        :type object_id: object or type
+        :param args: runtime args for the factory of a prototype
+        :param kwargs: runtime kwargs for the factory of a prototype
+
+        :return: a object that has the requested object_id
+        :rtype: object
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        :raise AppContextError: When runtime arguments are given for a
+                                object, that is not a prototype
+        '''
+        if args or kwargs:
+            return self._get_with_arguments(
+                self._get_object_def(object_id), args, kwargs)
+        try:
+            return self._singeltons[object_id]
+        except KeyError:
+            pass
+
+        object_def = self._get_object_def(object_id)
+        scope = object_def.scope
+        if scope == ObjectDefinition.SCOPE_PROTOTYPE:
+            return self._create(object_def)
+        elif scope == ObjectDefinition.SCOPE_SINGLETON:
+            return self._get_singleton(object_def, self._create)
+        elif scope == ObjectDefinition.SCOPE_POOLED:
+            return self._get_singleton(object_def, self._create_pool)
+        elif scope == ObjectDefinition.SCOPE_EXPIRING:
+            return self._get_expiring(object_def)
+        elif scope == ObjectDefinition.SCOPE_LRU:
+            return self._get_lru(object_def)
+        elif scope in (ObjectDefinition.SCOPE_THREAD,
+                       ObjectDefinition.SCOPE_CONTEXT):
+            store = self._get_scope_store(scope)
+            try:
+                return store.objects[object_id]
+            except KeyError:
+                obj = self._create(object_def)
+                store.add(object_def, obj)
+                return obj
+        return self._create(object_def)
+
+    def _get_scope_store(self, scope):
+        '''
+        Returns the store of the current thread or context.
+
+        :param scope: SCOPE_THREAD or SCOPE_CONTEXT
+        :type scope: str
+
+        :rtype: _ScopeStore
+        '''
+        generation = self._scope_generation
+        if scope == ObjectDefinition.SCOPE_THREAD:
+            store = getattr(self._thread_scope, 'store', None)
+            if store is None or store.generation != generation:
+                if store is not None:
+                    store.dispose()
+                store = self._thread_scope.store = _ScopeStore(generation)
+        else:
+            store = self._get_context_store()
+            if store is None or store.generation != generation:
+                if store is not None:
+                    store.dispose()
+                store = _ScopeStore(generation)
+                self._set_context_store(store)
+        return store
+
+    def _get_context_store(self):
+        # pylint: disable=missing-docstring
+        scopes = _CONTEXT_SCOPES.get()
+        if scopes is None:
+            return None
+        return scopes.get(self)
+
+    def _set_context_store(self, store):
+        # pylint: disable=missing-docstring
+        scopes = weakref.WeakKeyDictionary(_CONTEXT_SCOPES.get() or ())
+        if store is None:
+            scopes.pop(self, None)
+        else:
+            scopes[self] = store
+        _CONTEXT_SCOPES.set(scopes)
+
+    @contextlib.contextmanager
+    def context_scope(self):
+        '''
+        Context manager, that starts a new context scope. The context
+        objects created inside the block are disposed at its end.
+
+        Usage:
+
+        >>> with app_context.context_scope():
+        ...     handle(app_context.get('unit_of_work'))
+        '''
+        store = _ScopeStore(self._scope_generation)
+        previous = self._get_context_store()
+        self._set_context_store(store)
+        try:
+            yield
+        finally:
+            # only the own store is restored, the stores of other
+            # contexts created in the block are kept
+            self._set_context_store(previous)
+            store.dispose()
+
+    def end_thread_scope(self):
+        '''
+        Disposes the thread objects of the current thread, e.g. before a
+        pooled worker thread is reused.
+        '''
+        store = getattr(self._thread_scope, 'store', None)
+        if store is not None:
+            del self._thread_scope.store
+            store.dispose()
+
+    def _get_lock(self, object_id):
+        '''
+        Returns the reentrant creation lock of the given object id.
+        '''
+        lock = self._singleton_locks.get(object_id)
+        if lock is None:
+            lock = self._singleton_locks.setdefault(
+                object_id, threading.RLock())
+        return lock
+
+    def _get_expiring(self, object_def):
+        '''
+        Returns the cached object of a expiring definition and recreates
+        it, if necessary.
+
+        With refresh_ahead, an object within refresh_ahead seconds of its
+        expiry is returned immediately, while a new one is created in the
+        background. An expired object is recreated by one caller, while
+        concurrent callers get the expired object.
+
+        :param object_def: the configuration of the object
+        :type object_def: ObjectDefinition
+
+        :return: the cached object
+        :rtype: object
+        '''
+        object_id = object_def.object_id
+        entry = self._expiring.get(object_id)
+        if entry is not None:
+            obj, refresh_at, expires_at = entry
+            now = time.monotonic()
+            if now < refresh_at:
+                return obj
+            if now < expires_at:
+                self._schedule_refresh(object_def)
+                return obj
+        lock = self._get_lock(object_id)
+        if not lock.acquire(blocking=entry is None):
+            return entry[0]
+        try:
+            current = self._expiring.get(object_id)
+            if current is not entry and current is not None:
+                return current[0]
+            obj = self._create(object_def)
+            self._expiring[object_id] = self._expiring_entry(object_def, obj)
+        finally:
+            lock.release()
+        return obj
+
+    def _expiring_entry(self, object_def, obj):
+        # pylint: disable=missing-docstring
+        now = time.monotonic()
+        expires_at = now + object_def.options['ttl']
+        refresh_ahead = object_def.options.get('refresh_ahead')
+        refresh_at = expires_at - refresh_ahead if refresh_ahead else \
+            expires_at
+        return (obj, refresh_at, expires_at)
+
+    def _schedule_refresh(self, object_def):
+        '''
+        Recreates a expiring object in the background, unless it is
+        already being recreated.
+        '''
+        object_id = object_def.object_id
+        with self._refresh_lock:
+            if object_id in self._refreshing:
+                return
+            self._refreshing.add(object_id)
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix='app-context-refresh')
+        self._refresh_executor.submit(self._refresh, object_def)
+
+    def _refresh(self, object_def):
+        # pylint: disable=missing-docstring
+        object_id = object_def.object_id
+        try:
+            obj = self._create(object_def)
+            with self._refresh_lock:
+                # a reset or a new definition during the refresh drops
+                # the refreshed object
+                if object_id in self._expiring and \
+                        self._get_object_def(object_id) is object_def:
+                    self._expiring[object_id] = self._expiring_entry(
+                        object_def, obj)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Refreshing "%s" failed', object_id)
+        finally:
+            self._refreshing.discard(object_id)
+
+    def _get_with_arguments(self, object_def, args, kwargs):
+        '''
+        Creates a prototype with runtime arguments or returns the
+        memoized one for the same arguments. Only the memoize most
+        recently used objects are cached per definition, arguments that
+        are not hashable are never cached.
+
+        :param object_def: the configuration of the object
+        :type object_def: ObjectDefinition
+        :param args: the runtime args
+        :type args: tuple
+        :param kwargs: the runtime kwargs
+        :type kwargs: dict
+
+        :return: the new or memoized object
+        :rtype: object
+
+        :raise AppContextError: When the object is not a prototype
+        '''
+        if object_def.scope != ObjectDefinition.SCOPE_PROTOTYPE:
+            raise AppContextError(
+                'Runtime arguments are only supported for prototypes, '
+                '"%s" has the scope %s.'
+                % (object_def.object_id, object_def.scope))
+        memoize = object_def.options.get('memoize')
+        if not memoize:
+            return self._create(object_def, None, args, kwargs)
+        key = (args, frozenset(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return self._create(object_def, None, args, kwargs)
+        object_id = object_def.object_id
+        with self._memoize_lock:
+            cache = self._memoized.get(object_id)
+            if cache is not None and key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        obj = self._create(object_def, None, args, kwargs)
+        with self._memoize_lock:
+            cache = self._memoized.setdefault(
+                object_id, collections.OrderedDict())
+            # a concurrent call may have memoized a object meanwhile
+            obj = cache.setdefault(key, obj)
+            cache.move_to_end(key)
+            while len(cache) > memoize:
+                cache.popitem(last=False)
+        return obj
+
+    def _get_lru(self, object_def):
+        '''
+        Returns the cached object of a lru definition and creates it, if
+        necessary. Only the lru_size most recently used lru objects are
+        cached.
+
+        :param object_def: the configuration of the object
+        :type object_def: ObjectDefinition
+
+        :return: the cached object
+        :rtype: object
+        '''
+        object_id = object_def.object_id
+        with self._lru_lock:
+            try:
+                obj = self._lru[object_id]
+                self._lru.move_to_end(object_id)
+                return obj
+            except KeyError:
+                pass
+        with self._get_lock(object_id):
+            with self._lru_lock:
+                try:
+                    return self._lru[object_id]
+                except KeyError:
+                    pass
+            obj = self._create(object_def)
+            with self._lru_lock:
+                self._lru[object_id] = obj
+                while len(self._lru) > self.lru_size:
+                    self._lru.popitem(last=False)
+        return obj
+
+    def _create_pool(self, object_def):
+        '''
+        Creates the object pool of a pooled object definition.
+
+        :param object_def: the configuration of the pooled objects
+        :type object_def: ObjectDefinition
+
+        :return: the pool, that creates new objects on demand
+        :rtype: ObjectPool
+        '''
+        options = object_def.options
+        return ObjectPool(lambda: self._create(object_def),
+                          options.get('pool_size', 10),
+                          options.get('pool_timeout'),
+                          options.get('pool_idle_timeout'),
+                          object_def.dispose)
+
+    def _get_singleton(self, object_def, create):
+        '''
+        Creates the singleton of the given definition, unless another
+        thread already did it.
+
+        Every object id has its own lock, so the creation of different
+        singletons does not block each other. The locks are reentrant
+        to allow singletons that depend on other singletons.
+
+        :param object_def: the configuration of the singleton
+        :type object_def: ObjectDefinition
+        :param create: creates the singleton from the definition
+        :type create: callable
+
+        :return: the singleton object
+        :rtype: object
+        '''
+        object_id = object_def.object_id
+        with self._get_lock(object_id):
+            try:
+                return self._singeltons[object_id]
+            except KeyError:
+                pass
+            obj = create(object_def)
+            logger.debug('Adding "%s" to the singleton cache', object_id)
+            self._singeltons[object_id] = obj
+        return obj
+
+    async def aget(self, object_id):
+        '''
+        Returns the configured object with the given object_id and
+        supports coroutine factories.
+
+        Concurrent calls for a cold singleton share one creation.
+
+        :param object_id: the identifier of the requested object
+        :type object_id: object or type
+
+        :return: a object that has the requested object_id
+        :rtype: object
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        '''
+        try:
+            return self._singeltons[object_id]
+        except KeyError:
+            pass
+
+        object_def = self._get_object_def(object_id)
+        if object_def.scope == ObjectDefinition.SCOPE_SINGLETON:
+            return await self._aget_singleton(object_def)
+        elif object_def.scope == ObjectDefinition.SCOPE_POOLED:
+            return self._get_singleton(object_def, self._create_pool)
+        elif object_def.scope == ObjectDefinition.SCOPE_EXPIRING:
+            return self._get_expiring(object_def)
+        elif object_def.scope == ObjectDefinition.SCOPE_LRU:
+            return self._get_lru(object_def)
+        elif object_def.scope in (ObjectDefinition.SCOPE_THREAD,
+                                  ObjectDefinition.SCOPE_CONTEXT):
+            store = self._get_scope_store(object_def.scope)
+            try:
+                return store.objects[object_id]
+            except KeyError:
+                obj = await self._acreate(object_def)
+                store.add(object_def, obj)
+                return obj
+        return await self._acreate(object_def)
+
+    async def _aget_singleton(self, object_def):
+        '''
+        Awaits the creation of the singleton of the given definition.
+
+        The creation runs in its own task, that is shared by all
+        awaiters of the same event loop.
+
+        :param object_def: the configuration of the singleton
+        :type object_def: ObjectDefinition
+
+        :return: the singleton object
+        :rtype: object
+        '''
+        key = (asyncio.get_running_loop(), object_def.object_id)
+        task = self._pending_singletons.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._acreate_singleton(object_def))
+            self._pending_singletons[key] = task
+            task.add_done_callback(
+                lambda _: self._pending_singletons.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _acreate_singleton(self, object_def):
+        # pylint: disable=missing-docstring
+        obj = await self._acreate(object_def)
+        logger.debug('Adding "%s" to the singleton cache',
+                     object_def.object_id)
+        return self._singeltons.setdefault(object_def.object_id, obj)
+
+    def get_many(self, object_ids):
+        '''
+        Returns the configured objects with the given ids.
+
+        Every prototype is created at most once per call, so prototypes
+        shared by several of the requested objects are only created once.
+
+        :param object_ids: the identifiers of the requested objects
+        :type object_ids: iterable
+
+        :return: the requested objects by id
+        :rtype: dict
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        '''
+        batch = _BatchResolver(self, self.get)
+        return dict((object_id, batch.get(object_id))
+                    for object_id in object_ids)
+
+    def get_scope(self, object_id):
+        '''
+        Returns the scope of the object with the given id.
+
+        :param object_id: the object id
+        :type object_id: object or type
+
+        :return: the scope of the object
+        :rtype: object
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        '''
+        return self._get_object_def(object_id).scope
+
+    def _get_object_def(self, object_id):
+        '''
+        Returns the object definition for the given id.
+
+        :param object_id: the object id
+        :type object_id: object or type
+
+        :return: the object defintion
+        :rtype: ObjectDefintion
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        '''
+        try:
+            return self._config[object_id]
+        except KeyError:
+            raise ObjectDefinitionNotFound(
+                'No defintion for "%s" found.' % object_id)
+
+
+def _format_object_id(object_id):
+    '''
+    Returns a readable name for the object id of a trace.
+    '''
+    if isinstance(object_id, type):
+        return '%s.%s' % (object_id.__module__, object_id.__qualname__)
+    return str(object_id)
+
+
+class _TraceNode(object):
+    '''
+    A traced object creation.
+    '''
+
+    __slots__ = ('object_id', 'duration', 'children')
+
+    def __init__(self, object_id):
+        self.object_id = object_id
+        self.duration = 0.0
+        self.children = []
+
+    def as_dict(self):
+        # pylint: disable=missing-docstring
+        return {'id': _format_object_id(self.object_id),
+                'time': self.duration,
+                'children': [child.as_dict() for child in self.children]}
+
+
+class ResolutionTracer(object):
+    '''
+    Records the nested object creations of a context with the wall time
+    of every factory, see ApplicationContext.trace.
+
+    The time of a creation includes the creation of its dependencies.
+    '''
+
+    def __init__(self):
+        self.roots = []
+        self._local = threading.local()
+
+    def wrap(self, create):
+        '''
+        Returns a traced version of a ApplicationContext._create method.
+        '''
+        def traced_create(object_def, ioc_container=None,
+                          *runtime_arguments):
+            # pylint: disable=missing-docstring
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = []
+            node = _TraceNode(object_def.object_id)
+            (stack[-1].children if stack else self.roots).append(node)
+            stack.append(node)
+            started = time.perf_counter()
+            try:
+                return create(object_def, ioc_container, *runtime_arguments)
+            finally:
+                node.duration = time.perf_counter() - started
+                stack.pop()
+        return traced_create
+
+    def as_tree(self):
+        '''
+        Returns the recorded creations as nested dicts with the keys id,
+        time (in seconds) and children.
+
+        :rtype: list
+        '''
+        return [root.as_dict() for root in self.roots]
+
+    def to_json(self, **kwargs):
+        '''
+        Returns the tree of as_tree as JSON document.
+
+        :rtype: str
+        '''
+        return json.dumps(self.as_tree(), **kwargs)
+
+    def collapsed_stacks(self):
+        '''
+        Returns the recorded creations in the collapsed stack format of
+        flamegraph.pl and compatible tools. Every line holds a creation
+        stack and its own time in microseconds, without the time of the
+        nested creations.
+
+        :rtype: str
+        '''
+        totals = collections.OrderedDict()
+        pending = [((), root) for root in self.roots]
+        while pending:
+            parents, node = pending.pop()
+            stack = parents + (
+                _format_object_id(node.object_id).replace(';', ':'),)
+            own_time = node.duration - sum(c.duration for c in node.children)
+            key = ';'.join(stack)
+            totals[key] = totals.get(key, 0) + max(own_time, 0.0)
+            pending.extend((stack, child) for child in node.children)
+        return '\n'.join('%s %d' % (stack, round(seconds * 1e6))
+                         for stack, seconds in totals.items())
+
+
+class _BatchResolver(object):
+    '''
+    Container used by get_many to look up the dependencies of a batch.
+
+    Prototypes are created once and shared within the batch, all other
+    objects are looked up with the given get function.
+    '''
+
+    def __init__(self, app_context, get):
+        self._app_context = app_context
+        self._get = get
+        self._objects = {}
+
+    def get(self, object_id):
+        # pylint: disable=missing-docstring
+        try:
+            return self._objects[object_id]
+        except KeyError:
+            pass
+        object_def = self._app_context._get_object_def(object_id)
+        if object_def.scope == ObjectDefinition.SCOPE_PROTOTYPE:
+            obj = self._app_context._create(object_def, self)
+        else:
+            obj = self._get(object_id)
+        self._objects[object_id] = obj
+        return obj
+
+
+class _FrozenDefinition(object):
+    '''
+    Compact, immutable form of a ObjectDefinition.
+    '''
+
+    __slots__ = ('object_id', 'scope', 'factory', 'args_plan', 'kwargs_plan',
+                 'compiled')
+
+    def __init__(self, object_def):
+        self.object_id = object_def.object_id
+        self.scope = object_def.scope
+        self.factory = object_def.factory
+        self.args_plan = object_def._args_plan
+        self.kwargs_plan = object_def._kwargs_plan
+        # prototypes without async factory are created by the frozen
+        # context itself, all other scopes by the application context
+        self.compiled = (object_def.scope == ObjectDefinition.SCOPE_PROTOTYPE
+                         and not object_def.is_async)
+
+
+class FrozenApplicationContext(object):
+    '''
+    Immutable, compiled form of a ApplicationContext, see
+    ApplicationContext.freeze.
+
+    Every object id is mapped to an integer handle, that indexes the
+    compact definitions and the cached singletons. Hot lookups skip the
+    id hashing with get_by_handle or a bound accessor, get by id costs
+    as much as ApplicationContext.get. Prototypes
+    are created directly from the resolution plan, all other scopes are
+    delegated to the application context, which shares its singletons
+    with the frozen context. Statistics and tracing of the application
+    context do not cover the prototypes created by the frozen context.
+
+    Freezing does not save memory: the frozen context keeps the
+    application context and its definitions alive and adds its handles
+    and compact definitions.
+
+    Pools and fork unsafe singletons are not bound into accessors, and
+    their slots are cleared in a process forked after prefork.
+    '''
+
+    _EMPTY = object()
+
+    def __init__(self, app_context):
+        '''
+        Constructor
+
+        :param app_context: the context to compile
+        :type app_context: ApplicationContext
+        '''
+        self._app_context = app_context
+        # shared with the application context, so lookups by id are as
+        # fast as there
+        self._singeltons = app_context._singeltons
+        definitions = app_context._definitions()
+        self._handles = {}
+        self._definitions = []
+        for handle, object_def in enumerate(definitions.values()):
+            self._handles[object_def.object_id] = handle
+            self._definitions.append(_FrozenDefinition(object_def))
+        # handles, whose objects must not outlive a fork
+        self._volatile = frozenset(
+            self._handles[object_id]
+            for object_id in app_context._fork_unsafe_ids()) | frozenset(
+                handle for handle, frozen_def in enumerate(self._definitions)
+                if frozen_def.scope == ObjectDefinition.SCOPE_POOLED)
+        self._instances = [self._EMPTY] * len(self._definitions)
+        for object_id, obj in app_context._singeltons.items():
+            if object_id in self._handles:
+                self._instances[self._handles[object_id]] = obj
+
+    def register(self, *args, **kwargs):
+        '''
+        Always fails, a frozen context cannot be changed.
+
+        :raise FrozenContextError: always
+        '''
+        raise FrozenContextError('Cannot register, the context is frozen.')
+
+    def get_handle(self, object_id):
+        '''
+        Returns the integer handle of the given object id.
+
+        :param object_id: the object id
+        :type object_id: object or type
+
+        :rtype: int
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        '''
+        try:
+            return self._handles[object_id]
+        except KeyError:
+            raise ObjectDefinitionNotFound(
+                'No defintion for "%s" found.' % object_id)
+
+    def get_by_handle(self, handle):
+        '''
+        Returns the object with the given handle.
+
+        :param handle: a handle from get_handle
+        :type handle: int
+
+        :rtype: object
+        '''
+        obj = self._instances[handle]
+        if obj is self._EMPTY:
+            return self._resolve(handle)
+        return obj
+
+    def accessor(self, object_id):
+        '''
+        Returns a callable without arguments, that returns the object
+        with the given id.
+
+        :param object_id: the object id
+        :type object_id: object or type
+
+        :rtype: callable
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        '''
+        handle = self.get_handle(object_id)
+        frozen_def = self._definitions[handle]
+        obj = self._instances[handle]
+        if obj is not self._EMPTY and handle not in self._volatile:
+            return lambda: obj
+        if frozen_def.compiled:
+            factory = frozen_def.factory
+            args_plan = frozen_def.args_plan
+            kwargs_plan = frozen_def.kwargs_plan
+
+            def create():
+                return factory(*args_plan(self), **kwargs_plan(self))
+            return create
+        return functools.partial(self.get_by_handle, handle)
+
+    def get(self, object_id, *args, **kwargs):
+        '''
+        Returns the configured object with the given object_id. Runtime
+        arguments are passed to the application context, see
+        ApplicationContext.get.
+
+        :param object_id: the identifier of the requested object
+        :type object_id: object or type
+        :param args: runtime args for the factory of a prototype
+        :param kwargs: runtime kwargs for the factory of a prototype
+
+        :return: a object that has the requested object_id
+        :rtype: object
+
+        :raise ObjectDefinitionNotFound: When no definition is found
+        :raise AppContextError: When runtime arguments are given for a
+                                object, that is not a prototype
+        '''
+        if args or kwargs:
+            return self._app_context.get(object_id, *args, **kwargs)
+        try:
+            return self._singeltons[object_id]
+        except KeyError:
+            pass
+        return self.get_by_handle(self.get_handle(object_id))
+
+    def _resolve(self, handle):
+        '''
+        Creates or looks up the object, that is not in the slots yet.
+        '''
+        frozen_def = self._definitions[handle]
+        if frozen_def.compiled:
+            return frozen_def.factory(*frozen_def.args_plan(self),
+                                      **frozen_def.kwargs_plan(self))
+        obj = self._app_context.get(frozen_def.object_id)
+        if frozen_def.scope in (ObjectDefinition.SCOPE_SINGLETON,
+                                ObjectDefinition.SCOPE_POOLED):
+            self._instances[handle] = obj
+        return obj
+
+    async def aget(self, object_id):
+        '''
+        Returns the configured object with the given object_id and
+        supports coroutine factories.
+        '''
+        handle = self.get_handle(object_id)
+        obj = self._instances[handle]
+        if obj is self._EMPTY:
+            return await self._app_context.aget(object_id)
+        return obj
+
+    def get_many(self, object_ids):
+        '''
+        Returns the configured objects with the given ids, see
+        ApplicationContext.get_many.
+        '''
+        batch = _BatchResolver(self._app_context, self.get)
+        return dict((object_id, batch.get(object_id))
+                    for object_id in object_ids)
+
+    def get_scope(self, object_id):
+        '''
+        Returns the scope of the object with the given id.
+        '''
+        return self._definitions[self.get_handle(object_id)].scope
+
+    def _reset_after_fork(self):
+        '''
+        Clears the slots of the objects, that the application context
+        dropped in a forked process.
+        '''
+        for handle in self._volatile:
+            self._instances[handle] = self._EMPTY
+
+    def _get_object_def(self, object_id):
+        # pylint: disable=missing-docstring
+        return self._app_context._get_object_def(object_id)
+
+
+class ChildApplicationContext(ApplicationContext):
+    '''
+    An application context that inherits the definitions and singletons
+    of a parent context and only stores its own overriding definitions.
+
+    Objects are looked up in the parent, unless their definition or one
+    of their (transitive) dependencies is overridden in the child. Only
+    these local objects are created and cached by the child. All other
+    ids are passed straight to the ancestor that owns them or to the root
+    context, so every lookup costs a constant number of dict lookups,
+    independent of the depth of the context hierarchy.
+
+    A child only keeps the overrides of its ancestors and the ids owned
+    by them, never a copy of the inherited definitions. validate and
+    warm_up only cover the local objects, the parent is already valid.
+
+    Register the definitions of a context before creating children of it.
+    '''
+
+    def __init__(self, parent, config=None):
+        '''
+        Constructor
+
+        :param parent: the context to inherit from
+        :type parent: ApplicationContext
+        :param config: the overriding definitions
+        :type config: tuple or list
+        '''
+        self._parent = parent
+        if isinstance(parent, ChildApplicationContext):
+            self._root = parent._root
+            self._inherited_overrides = dict(parent._inherited_overrides)
+            self._inherited_overrides.update(parent._config)
+            self._owners = dict(parent._owners)
+            for object_id in parent._get_local_ids():
+                self._owners[object_id] = parent
+        else:
+            self._root = parent
+            self._inherited_overrides = {}
+            self._owners = {}
+        self._local_ids = frozenset()
+        super(ChildApplicationContext, self).__init__(config)
+
+    def _add_definition(self, object_def):
+        # pylint: disable=missing-docstring
+        super(ChildApplicationContext, self)._add_definition(object_def)
+        self._local_ids = None
+
+    def reset(self):
+        # pylint: disable=missing-docstring
+        super(ChildApplicationContext, self).reset()
+        self._local_ids = frozenset()
+
+    def _definitions(self):
+        '''
+        Returns the inherited definitions merged with the overrides.
+
+        The dict is built on every call and only needed for operations on
+        the whole graph, like dependency_graph or freeze.
+        '''
+        definitions = dict(self._root._definitions())
+        definitions.update(self._inherited_overrides)
+        definitions.update(self._config)
+        return definitions
+
+    def _get_local_ids(self):
+        '''
+        Returns the ids of all objects, that are overridden or depend on
+        overridden objects.
+        '''
+        local_ids = self._local_ids
+        if local_ids is None:
+            root_dependents = self._root._dependents()
+            # edges of the overrides, that are not in the root graph
+            override_dependents = {}
+            for overrides in (self._inherited_overrides, self._config):
+                for object_id, object_def in overrides.items():
+                    for inject in object_def.injects:
+                        override_dependents.setdefault(
+                            inject.object_id, []).append(object_id)
+            local_ids = set()
+            stack = list(self._config)
+            while stack:
+                object_id = stack.pop()
+                if object_id not in local_ids:
+                    local_ids.add(object_id)
+                    stack.extend(root_dependents.get(object_id, ()))
+                    stack.extend(override_dependents.get(object_id, ()))
+            self._local_ids = local_ids = frozenset(local_ids)
+        return local_ids
+
+    def _dependency_levels(self):
+        '''
+        Sorts the local object ids topologically. A cycle through a
+        override only contains local ids, so the inherited graph does not
+        have to be checked again.
+        '''
+        local_ids = self._get_local_ids()
+        graph = {}
+        for object_id in local_ids:
+            object_def = self._get_object_def(object_id)
+            for inject in object_def.injects:
+                if not self._has_definition(inject.object_id):
+                    raise ObjectDefinitionNotFound(
+                        'No defintion for "%s" found, required by "%s".'
+                        % (inject.object_id, object_id))
+            graph[object_id] = set(dependency for dependency
+                                   in object_def.dependencies
+                                   if dependency in local_ids)
+        return _topological_levels(graph)
+
+    def _has_definition(self, object_id):
+        # pylint: disable=missing-docstring
+        try:
+            self._get_object_def(object_id)
+        except ObjectDefinitionNotFound:
+            return False
+        return True
+
+    def get(self, object_id, *args, **kwargs):
+        # pylint: disable=missing-docstring
+        if object_id in self._get_local_ids():
+            return super(ChildApplicationContext, self).get(
+                object_id, *args, **kwargs)
+        return self._owners.get(object_id, self._root).get(
+            object_id, *args, **kwargs)
+
+    async def aget(self, object_id):
+        # pylint: disable=missing-docstring
+        if object_id in self._get_local_ids():
+            return await super(ChildApplicationContext, self).aget(object_id)
+        return await self._owners.get(object_id, self._root).aget(object_id)
+
+    def _get_object_def(self, object_id):
+        # pylint: disable=missing-docstring
+        try:
+            return self._config[object_id]
+        except KeyError:
+            pass
+        try:
+            return self._inherited_overrides[object_id]
+        except KeyError:
+            return self._root._get_object_def(object_id)
+
+
+def _reset_preforked_contexts():
+    '''
+    Fork hook, that resets the contexts prepared by prefork in the child.
+    '''
+    for context in list(_PREFORKED_CONTEXTS):
+        context._reset_after_fork()
+
+
+def _topological_levels(graph):
+    '''
+    Sorts a dependency graph topologically with Kahn's algorithm.
+
+    :param graph: the ids mapped to the ids they depend on, all
+                  dependencies must be nodes of the graph
+    :type graph: dict
+
+    :return: lists of ids, every id only depends on ids of the previous
+             lists.
+    :rtype: list
+
+    :raise CircularDependencyError: When the graph contains a cycle
+    '''
+    pending = {}
+    dependents = dict((object_id, []) for object_id in graph)
+    for object_id, dependencies in graph.items():
+        pending[object_id] = len(dependencies)
+        for dependency in dependencies:
+            dependents[dependency].append(object_id)
+    levels = []
+    level = [object_id for object_id, count in pending.items() if not count]
+    while level:
+        levels.append(level)
+        next_level = []
+        for object_id in level:
+            for dependent in dependents[object_id]:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    next_level.append(dependent)
+        level = next_level
+    if sum(len(level) for level in levels) < len(graph):
+        remaining = dict(
+            (object_id, set(d for d in graph[object_id] if pending[d]))
+            for object_id, count in pending.items() if count)
+        raise CircularDependencyError(_find_cycle(remaining))
+    return levels
+
+
+def _find_cycle(graph):
+    '''
+    Returns a dependency cycle of a graph, in which every node has at
+    least one dependency.
+    '''
+    path = []
+    positions = {}
+    node = next(iter(graph))
+    while node not in positions:
+        positions[node] = len(path)
+        path.append(node)
+        node = next(iter(graph[node]))
+    return path[positions[node]:] + [node]
+
+
+class StateSessionCodec(object):
+    '''
+    Stores the state of session scoped objects in the session.
+
+    The state is a copy of the result of __getstate__ or the instance
+    __dict__, so it must be serializable by the session serializer.
+    Objects are restored without calling __init__, which requires a class
+    as factory.
+
+    Injected dependencies are not stored: attributes named like a factory
+    parameter, that gets a inject marker, or like it with a leading
+    underscore, are left out of the state and injected again, when the
+    object is restored.
+    '''
+
+    INJECTED_KEY = '__inject__'
+
+    def encode(self, object_def, obj):
+        '''
+        Returns the state of the object, that is stored in the session.
+        '''
+        state = None
+        if hasattr(obj, '__getstate__'):
+            state = obj.__getstate__()
+        if state is None:
+            state = vars(obj)
+        injected = {}
+        if isinstance(state, dict):
+            for name in object_def.injected_parameters():
+                for attribute in (name, '_' + name):
+                    if attribute in state:
+                        injected[attribute] = name
+        if injected:
+            state = dict((k, v) for k, v in state.items()
+                         if k not in injected)
+        state = copy.deepcopy(state)
+        if injected:
+            state[self.INJECTED_KEY] = injected
+        return state
+
+    def decode(self, object_def, state, ioc_container):
+        '''
+        Restores a object of the given definition from its state.
+        '''
+        cls = object_def.factory
+        if isinstance(cls, LazyFactory):
+            cls = cls.load()
+        if not isinstance(cls, type):
+            raise AppContextError(
+                'Cannot restore "%s", its factory is not a class.'
+                % object_def.object_id)
+        obj = cls.__new__(cls)
+        state = copy.deepcopy(state)
+        if isinstance(state, dict) and self.INJECTED_KEY in state:
+            markers = object_def.injected_parameters()
+            for attribute, name in state.pop(self.INJECTED_KEY).items():
+                if name in markers:
+                    state[attribute] = markers[name](ioc_container)
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(state)
+        else:
+            obj.__dict__.update(state)
+        return obj
+
+
+class PickleSessionCodec(object):
+    '''
+    Stores session scoped objects as base64 encoded pickles.
+
+    Only use it with sessions that cannot be manipulated by the client.
+    '''
+
+    def encode(self, object_def, obj):
+        # pylint: disable=missing-docstring,unused-argument
+        return base64.b64encode(
+            pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)).decode('ascii')
+
+    def decode(self, object_def, state, ioc_container):
+        # pylint: disable=missing-docstring,unused-argument
+        return pickle.loads(base64.b64decode(state))
+
+
+class RequestApplicationContext(object):
+    '''
+    Extends the application context with session and request scope
+    support.
+
+    The stores are created on first use, so requests that only look up
+    singletons and prototypes neither allocate a request store nor
+    load the session.
+
+    Session scoped objects are kept as encoded state in the session, see
+    StateSessionCodec. The codec can be changed per definition with the
+    session_codec option. save_session writes back only the states that
+    have changed, so the session is only marked as modified when a
+    session scoped object has been changed.
+    '''
+
+    SESSION_KEY = 'app_context_store'
+
+    session_codec = StateSessionCodec()
+
+    _MISSING = object()
+
+    def __init__(self, application_context, request):
+        self._app_context = application_context
+        self.request = request
+        self._request_store = None
+        self._session_objects = None
+
+    def _get_request_store(self):
+        if self._request_store is None:
+            self._request_store = {}
+        return self._request_store
+
+    def _get_session_codec(self, object_def):
+        return object_def.options.get('session_codec', self.session_codec)
+
+    def _load_session_object(self, object_id):
+        '''
+        Returns the session scoped object, restored from the session, if
+        necessary.
+
+        :return: the object or _MISSING, if the session does not contain
+                 the object.
+        '''
+        if self._session_objects is None:
+            self._session_objects = {}
+        try:
+            return self._session_objects[object_id][0]
+        except KeyError:
+            pass
+        state = self.request.session.get(self.SESSION_KEY, {}).get(
+            object_id, self._MISSING)
+        if state is self._MISSING:
+            return state
+        object_def = self._app_context._get_object_def(object_id)
+        codec = self._get_session_codec(object_def)
+        obj = codec.decode(object_def, state, self)
+        # the stored state went through the session serializer, e.g. JSON
+        # turns tuples into lists, so the object is encoded again for the
+        # comparison in save_session
+        self._session_objects[object_id] = (obj,
+                                            codec.encode(object_def, obj))
+        return obj
+
+    def get(self, object_id, *args, **kwargs):
+        '''
+        Returns the configured object with the given object_id.
+
+        :param object_id: the identifier of the requested object
+        :type object_id: object
+        :param args: runtime args for a prototype, see
+                     ApplicationContext.get
+        :param kwargs: runtime kwargs for a prototype
+
+        :return: a object that has the requested object_id
+        :rtype: object
+        '''
+        if args or kwargs:
+            return self._app_context.get(object_id, *args, **kwargs)
+        scope = self._app_context.get_scope(object_id)
+        if scope == ObjectDefinition.SCOPE_REQUEST:
+            store = self._get_request_store()
+            try:
+                return store[object_id]
+            except KeyError:
+                obj = store[object_id] = self._app_context.get(object_id)
+                return obj
+        elif scope == ObjectDefinition.SCOPE_SESSION:
+            obj = self._load_session_object(object_id)
+            if obj is self._MISSING:
+                obj = self._app_context.get(object_id)
+                self._session_objects[object_id] = (obj, self._MISSING)
+            return obj
+        return self._app_context.get(object_id)
+
+    __call__ = get
+
+    def get_many(self, object_ids):
+        '''
+        Returns the configured objects with the given ids, see
+        ApplicationContext.get_many.
+
+        :param object_ids: the identifiers of the requested objects
+        :type object_ids: iterable
+
+        :return: the requested objects by id
+        :rtype: dict
+        '''
+        batch = _BatchResolver(self._app_context, self.get)
+        return dict((object_id, batch.get(object_id))
+                    for object_id in object_ids)
+
+    async def aget(self, object_id):
+        '''
+        Returns the configured object with the given object_id and
+        supports coroutine factories.
+
+        :param object_id: the identifier of the requested object
+        :type object_id: object
+
+        :return: a object that has the requested object_id
+        :rtype: object
+        '''
+        scope = self._app_context.get_scope(object_id)
+        if scope == ObjectDefinition.SCOPE_REQUEST:
+            store = self._get_request_store()
+            try:
+                return store[object_id]
+            except KeyError:
+                obj = store[object_id] = \
+                    await self._app_context.aget(object_id)
+                return obj
+        elif scope == ObjectDefinition.SCOPE_SESSION:
+            try:
+                return self._session_objects[object_id][0]
+            except (KeyError, TypeError):
+                pass
+            # session backends may query the database, which is not
+            # allowed on the event loop
+            from asgiref.sync import sync_to_async
+            obj = await sync_to_async(self._load_session_object)(object_id)
+            if obj is self._MISSING:
+                obj = await self._app_context.aget(object_id)
+                self._session_objects[object_id] = (obj, self._MISSING)
+            return obj
+        return await self._app_context.aget(object_id)
+
+    def save_session(self):
+        '''
+        Writes the states of changed session scoped objects to the
+        session.
+
+        :return: True, if the session has been modified
+        :rtype: bool
+        '''
+        if not self._session_objects:
+            return False
+        changed = {}
+        for object_id, (obj, state) in self._session_objects.items():
+            object_def = self._app_context._get_object_def(object_id)
+            new_state = self._get_session_codec(object_def).encode(object_def,
+                                                                   obj)
+            if new_state != state:
+                changed[object_id] = new_state
+                self._session_objects[object_id] = (obj, new_state)
+        if not changed:
+            return False
+        store = dict(self.request.session.get(self.SESSION_KEY, {}))
+        store.update(changed)
+        self.request.session[self.SESSION_KEY] = store
+        return True
+
+    async def asave_session(self):
+        '''
+        Like save_session, but writes to the session outside of the
+        event loop.
+
+        :return: True, if the session has been modified
+        :rtype: bool
+        '''
+        if not self._session_objects:
+            return False
+        from asgiref.sync import sync_to_async
+        return await sync_to_async(self.save_session)()
+
+    def dispose(self):
+        '''
+        Calls the dispose hooks of all request scoped objects and clears
+        the request store.
+        '''
+        store, self._request_store = self._request_store, None
+        if not store:
+            return
+        for object_id, obj in store.items():
+            try:
+                self._app_context._get_object_def(object_id).dispose(obj)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Disposing "%s" failed', object_id)
+
+
+class ApplicationContextMiddleware(object):
+    """
+    Middleware that sets `app_context` attribute to request object.
+
+    Without an explicit app_context, the context is loaded from the
+    django settings, see ApplicationContext.load_settings_config.
+
+    The attribute is a RequestApplicationContext, that supports request
+    and session scoped objects. Changed session scoped objects are saved
+    and the request scoped objects are disposed when the response is
+    returned, or when a streaming response is closed. Place it after the
+    SessionMiddleware. The middleware supports sync and async request
+    handling, async views must use aget for session scoped objects.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, app_context=None):
+        self.get_response = get_response
+        if app_context is None:
+            app_context = ApplicationContext()
+            app_context.load_settings_config()
+        self._app_context = app_context
+        self._is_async = asyncio.iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction = getattr(
+                inspect, 'markcoroutinefunction', None)
+            if markcoroutinefunction is None:
+                # python < 3.12, asgiref is installed with django >= 3.0
+                from asgiref.sync import markcoroutinefunction
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        app_context = RequestApplicationContext(self._app_context, request)
+        request.app_context = app_context
+        try:
+            response = self.get_response(request)
+            app_context.save_session()
+        except BaseException:
+            app_context.dispose()
+            raise
+        return _dispose_with_response(response, app_context)
+
+    async def __acall__(self, request):
+        # pylint: disable=missing-docstring
+        app_context = RequestApplicationContext(self._app_context, request)
+        request.app_context = app_context
+        try:
+            response = await self.get_response(request)
+            await app_context.asave_session()
+        except BaseException:
+            app_context.dispose()
+            raise
+        return _dispose_with_response(response, app_context)
+
+
+def _dispose_with_response(response, app_context):
+    '''
+    Disposes the request scoped objects now or, for a streaming response,
+    when the server closes the response, since the stream may still use
+    them.
+    '''
+    if not getattr(response, 'streaming', False):
+        app_context.dispose()
+        return response
+    close = response.close
+
+    def close_and_dispose():  # pylint: disable=missing-docstring
+        try:
+            close()
+        finally:
+            app_context.dispose()
+    response.close = close_and_dispose
+    return response
@@ -0,0 +1,60 @@
+# Copyright 2014 Michael Trunner
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Management command, that traces the object creation of the application
+context configured in the django settings.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from djhelpers.ioc import AppContextError, ApplicationContext
+
+
+class Command(BaseCommand):
+    # pylint: disable=missing-docstring
+
+    help = ('Traces the creation of the given object ids or of all '
+            'singletons and prints it as collapsed stacks for flame '
+            'graph tools or as JSON tree.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('object_ids', nargs='*', metavar='object_id',
+                            help='objects to create, defaults to a full '
+                                 'warm up')
+        parser.add_argument('--format', choices=['collapsed', 'json'],
+                            default='collapsed')
+        parser.add_argument('--output', metavar='FILE',
+                            help='write the trace to FILE')
+
+    def handle(self, *args, **options):
+        app_context = ApplicationContext()
+        try:
+            app_context.load_settings_config()
+            with app_context.trace() as tracer:
+                if options['object_ids']:
+                    for object_id in options['object_ids']:
+                        app_context.get(object_id)
+                else:
+                    app_context.warm_up()
+        except AppContextError as e:
+            raise CommandError(str(e))
+
+        if options['format'] == 'json':
+            result = tracer.to_json(indent=2)
+        else:
+            result = tracer.collapsed_stacks()
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(result + '\n')
+        else:
+            self.stdout.write(result)
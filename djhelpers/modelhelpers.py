@@ -14,8 +14,106 @@
 """
 Some django module helpers.
 """
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
 
-def short_description(description, **kwargs):
+_request_cache = contextvars.ContextVar('request_cache', default=None)
+
+
+class _RequestCache(object):
+    """
+    Bounded store of the results of cached short_description functions,
+    the least recently used results are evicted first.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        # pylint: disable=missing-docstring
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is not None:
+                self.results.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        # pylint: disable=missing-docstring
+        with self.lock:
+            self.results[key] = entry
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+
+@contextlib.contextmanager
+def request_cache(max_size=1024, cache=None):
+    """
+    Context manager, that caches the results of the short_description
+    functions with cache=True inside the block. The cached results are
+    dropped, when the block is left.
+
+    The block yields its cache, that can be passed to a later block to
+    use the cached results again, e.g. to render a response lazily.
+
+    :param max_size: the max. number of cached results
+    :type max_size: int
+    :param cache: the cache of an earlier block
+    :type cache: object or None
+    """
+    if cache is None:
+        cache = _RequestCache(max_size)
+    token = _request_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _request_cache.reset(token)
+
+
+def _cache_key_part(arg):
+    """
+    Model instances are identified by class and primary key, all other
+    arguments by identity.
+    """
+    if hasattr(arg, '_meta') and getattr(arg, 'pk', None) is not None:
+        return type(arg), arg.pk
+    return id(arg)
+
+
+def _cached(func):
+    """
+    Wraps a function, so its results are cached in the active
+    request_cache. Without a active cache it is called as is.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # pylint: disable=missing-docstring
+        store = _request_cache.get()
+        if store is None:
+            return func(*args, **kwargs)
+        try:
+            key = (func, tuple(_cache_key_part(a) for a in args),
+                   frozenset(kwargs.items()))
+            hash(key)
+        except TypeError:
+            return func(*args, **kwargs)
+        entry = store.get(key)
+        if entry is None:
+            # the arguments are kept with the result, so their ids are
+            # not reused while the result is cached
+            entry = (args, func(*args, **kwargs))
+            store.put(key, entry)
+        return entry[1]
+    return wrapper
+
+
+def short_description(description, select_related=None,
+                      prefetch_related=None, annotations=None, cache=False,
+                      **kwargs):
     """
     This decorator adds the django short_description attribute to the
     given function.
@@ -23,18 +121,51 @@ def short_description(description, **kwargs):
     It also adds every keyword argument as extra attribute to the
     decorated function.
 
+    The query hints tell a admin with the QueryHintsModelAdminMixin,
+    which relations and annotations the function reads, so they can be
+    loaded with the changelist query instead of one query per row.
+
+    Usage:
+
+    >>> @short_description('Author', select_related=['author'])
+    ... def author_name(self, obj):
+    ...     return obj.author.name
+    >>>
+    >>> @short_description('Books', annotations={'book_count': Count('books')})
+    ... def books(self, obj):
+    ...     return obj.book_count
+
     :param description: the value for the short description attribute
     :type description: str or unicode
+    :param select_related: the relations for QuerySet.select_related
+    :type select_related: list or None
+    :param prefetch_related: the lookups for QuerySet.prefetch_related
+    :type prefetch_related: list or None
+    :param annotations: the annotations for QuerySet.annotate by name
+    :type annotations: dict or None
+    :param cache: caches the result per object inside a request_cache
+                  block, e.g. of the RequestCacheModelAdminMixin
+    :type cache: bool
 
     :return: the decorator function
     :rtype: function
     """
+    if select_related is not None:
+        kwargs['select_related'] = tuple(select_related)
+    if prefetch_related is not None:
+        kwargs['prefetch_related'] = tuple(prefetch_related)
+    if annotations is not None:
+        kwargs['annotations'] = dict(annotations)
+
     def _wrapper(func):
         """
         Internal wrapper function.
 
-        It only adds some attributes to the function object.
+        It only adds some attributes to the function object, cached
+        functions are wrapped.
         """
+        if cache:
+            func = _cached(func)
         func.short_description = description
         for key in kwargs:
             setattr(func, key, kwargs[key])
@@ -11,11 +11,119 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import contextlib
+import gc
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 import mock
 
-from djhelpers.adminhelpers import ActionDecorator
-from djhelpers.modelhelpers import short_description
+from djhelpers.adminhelpers import (ActionDecorator, Job, LocalJobBackend,
+                                    PerformanceModelAdminMixin,
+                                    PerformanceSample, PerformanceStats,
+                                    QueryHintsModelAdminMixin,
+                                    RequestCacheModelAdminMixin,
+                                    chunked_action, current_job,
+                                    iter_batches, job_status, normalize_sql,
+                                    performance_stats)
+from djhelpers.ioc import (AppContextError, ApplicationContext,
+                           ApplicationContextMiddleware,
+                           ChildApplicationContext, CircularDependencyError,
+                           ConfigurationError, FrozenContextError, Inject,
+                           LazyFactory, LazyInject, LazyProxy,
+                           ObjectDefinition,
+                           ObjectDefinitionNotFound, ObjectPool,
+                           PickleSessionCodec, PoolTimeout,
+                           RequestApplicationContext, parse_config)
+from djhelpers.modelhelpers import request_cache, short_description
+
+try:
+    import asgiref.sync  # pylint: disable=unused-import
+    _MARK_COROUTINE = True
+except ImportError:
+    _MARK_COROUTINE = hasattr(inspect, 'markcoroutinefunction')
+
+
+try:
+    from django.contrib.admin import ModelAdmin
+    from django.db.models import Count
+    _DJANGO = True
+except ImportError:
+    ModelAdmin = object
+    Count = mock.Mock()
+    _DJANGO = False
+
+# the url patterns of the tests, that render the real admin views
+urlpatterns = []
+
+_admin_site = None
+
+
+def _setup_django():
+    '''
+    Configures django with a in-memory database once and returns the
+    admin site of the tests, that use the real admin views.
+    '''
+    global _admin_site  # pylint: disable=global-statement
+    if _admin_site is not None:
+        return _admin_site
+    import django
+    from django.conf import settings
+    settings.configure(
+        SECRET_KEY='tests',
+        USE_TZ=True,
+        ROOT_URLCONF=__name__,
+        DEFAULT_AUTO_FIELD='django.db.models.AutoField',
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': ':memory:'}},
+        INSTALLED_APPS=['django.contrib.admin', 'django.contrib.auth',
+                        'django.contrib.contenttypes',
+                        'django.contrib.messages',
+                        'django.contrib.sessions'],
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+            'OPTIONS': {'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages']}}])
+    django.setup()
+    from django.contrib.admin import AdminSite
+    from django.contrib.auth.models import Group
+    from django.core.management import call_command
+    from django.urls import path
+    _admin_site = AdminSite(name='admin')
+    _admin_site.register(Group)
+    urlpatterns.append(path('admin/', _admin_site.urls))
+    call_command('migrate', verbosity=0)
+    return _admin_site
+
+
+def _admin_request(method='get', data=None):
+    '''
+    Returns a request of a superuser for the group changelist.
+    '''
+    from django.contrib.auth.models import User
+    from django.contrib.messages.storage.fallback import FallbackStorage
+    from django.test import RequestFactory
+    request = getattr(RequestFactory(), method)('/admin/auth/group/',
+                                                data or {})
+    request.user = User(username='admin', is_active=True, is_staff=True,
+                        is_superuser=True)
+    request.session = {}
+    request._messages = FallbackStorage(request)
+    request._dont_enforce_csrf_checks = True
+    return request
 
 
 class ShortDescriptionDecoratorTest(unittest.TestCase):
@@ -46,6 +154,348 @@ class ShortDescriptionDecoratorTest(unittest.TestCase):
         self.assertEqual(tfunc.short_description, description)
         self.assertEqual(tfunc.boolean, mock.sentinel.kwarg)
 
+    def test_cache(self):
+        # Arrange
+        calls = []
+
+        @short_description('total', cache=True)
+        def total(obj):
+            calls.append(obj)
+            return len(calls)
+        first, second = object(), object()
+        # Act
+        uncached = [total(first), total(first)]
+        with request_cache(max_size=1):
+            cached = [total(first), total(first), total(second),
+                      total(first)]
+        # Assert
+        self.assertEqual(uncached, [1, 2])
+        self.assertEqual(cached, [3, 3, 4, 5])
+        self.assertEqual(total.short_description, 'total')
+
+
+class Book(object):
+
+    @property
+    @short_description('Publisher', select_related=['publisher'])
+    def publisher_name(self):
+        return self.publisher.name
+
+
+class BaseAdmin(object):
+
+    model = Book
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def get_queryset(self, request):
+        return self.queryset
+
+    def get_list_display(self, request):
+        return self.list_display
+
+
+class BookAdmin(QueryHintsModelAdminMixin, BaseAdmin):
+
+    list_display = ['title', 'author_name', 'publisher_name', 'tags']
+
+    @short_description('Author', select_related=['author'],
+                       prefetch_related=['author__awards'])
+    def author_name(self, obj):
+        return obj.author.name
+
+    @short_description('Tags', prefetch_related=['tags', 'author__awards'],
+                       annotations={'tag_count': mock.sentinel.count})
+    def tags(self, obj):
+        return obj.tag_count
+
+
+class GroupHintsAdmin(QueryHintsModelAdminMixin, ModelAdmin):
+
+    list_display = ['name', 'permission_names']
+    actions = ['record']
+
+    def __init__(self, *args, **kwargs):
+        super(GroupHintsAdmin, self).__init__(*args, **kwargs)
+        self.recorded = []
+
+    @short_description('Permissions', prefetch_related=['permissions'],
+                       annotations={'permission_count': Count('permissions')})
+    def permission_names(self, obj):
+        return ', '.join(p.codename for p in obj.permissions.all())
+
+    def record(self, request, queryset):
+        from django.http import HttpResponse
+        self.recorded.append(queryset)
+        return HttpResponse('recorded')
+
+
+class QueryHintsTest(unittest.TestCase):
+
+    def test_get_queryset(self):
+        # Arrange
+        queryset = mock.Mock()
+        admin = BookAdmin(queryset)
+        # Act
+        result = admin.get_queryset(mock.sentinel.request)
+        # Assert
+        self.assertIs(result, queryset)
+        queryset.select_related.assert_not_called()
+
+    @unittest.skipUnless(_DJANGO, 'requires django')
+    def test_changelist_queryset(self):
+        # Arrange
+        site = _setup_django()
+        from django.contrib.auth.models import Group
+        Group.objects.bulk_create([Group(name='a'), Group(name='b')])
+        self.addCleanup(Group.objects.all().delete)
+        admin = GroupHintsAdmin(Group, site)
+        pks = [str(pk) for pk in Group.objects.values_list('pk', flat=True)]
+        # Act
+        response = admin.changelist_view(_admin_request())
+        action_response = admin.changelist_view(_admin_request(
+            'post', {'action': 'record', 'index': '0',
+                     '_selected_action': pks}))
+        # Assert
+        queryset = response.context_data['cl'].queryset
+        self.assertEqual(queryset._prefetch_related_lookups,
+                         ('permissions',))
+        self.assertIn('permission_count', queryset.query.annotations)
+        self.assertEqual(action_response.status_code, 200)
+        recorded = admin.recorded[0]
+        self.assertEqual(recorded._prefetch_related_lookups, ())
+        self.assertNotIn('permission_count', recorded.query.annotations)
+        self.assertEqual(sorted(group.name for group in recorded),
+                         ['a', 'b'])
+
+
+class LazyResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+        self.is_rendered = False
+
+    def render(self):
+        self.content = [func() for func in self.content]
+        self.is_rendered = True
+
+
+class ViewAdmin(BaseAdmin):
+
+    def changelist_view(self, request):
+        return LazyResponse([self.total, self.total])
+
+    def changeform_view(self, request, object_id):
+        return LazyResponse([self.total, self.total])
+
+
+class CachedViewAdmin(RequestCacheModelAdminMixin, ViewAdmin):
+    pass
+
+
+class TitledGroupAdmin(RequestCacheModelAdminMixin, ModelAdmin):
+
+    list_display = ['name', 'name_length', 'name_length_again']
+
+    def __init__(self, *args, **kwargs):
+        super(TitledGroupAdmin, self).__init__(*args, **kwargs)
+        self.calls = []
+
+    def changelist_view(self, request, extra_context=None):
+        response = super(TitledGroupAdmin, self).changelist_view(
+            request, extra_context)
+        response.context_data['title'] = 'Cached groups'
+        return response
+
+    @short_description('Length', cache=True)
+    def name_length(self, obj):
+        self.calls.append(obj.pk)
+        return len(obj.name) + 1
+
+    @short_description('Length again')
+    def name_length_again(self, obj):
+        return self.name_length(obj)
+
+
+class RequestCacheAdminTest(unittest.TestCase):
+
+    def test_views_render_inside_the_cache(self):
+        # Arrange
+        calls = []
+        admin = CachedViewAdmin(mock.sentinel.queryset)
+
+        @short_description('Total', cache=True)
+        def total():
+            calls.append(None)
+            return len(calls)
+        admin.total = total
+        # Act
+        changelist = admin.changelist_view(mock.sentinel.request)
+        changeform = admin.changeform_view(mock.sentinel.request, '1')
+        rendered = changelist.is_rendered
+        changelist.render()
+        changeform.render()
+        # Assert
+        self.assertFalse(rendered)
+        self.assertEqual(changelist.content, [1, 1])
+        self.assertEqual(changeform.content, [2, 2])
+        self.assertNotIn('render', vars(changelist))
+        self.assertEqual(total(), 3)
+
+    @unittest.skipUnless(_DJANGO, 'requires django')
+    def test_context_changes_after_the_view(self):
+        # Arrange
+        site = _setup_django()
+        from django.contrib.auth.models import Group
+        Group.objects.bulk_create([Group(name='a'), Group(name='b')])
+        self.addCleanup(Group.objects.all().delete)
+        admin = TitledGroupAdmin(Group, site)
+        # Act
+        response = admin.changelist_view(_admin_request())
+        response.render()
+        # Assert
+        self.assertIn(b'Cached groups', response.content)
+        self.assertEqual(response.content.count(b'>2<'), 4)
+        self.assertEqual(len(admin.calls), 2)
+
+
+class PerformanceAdmin(PerformanceModelAdminMixin, BaseAdmin):
+
+    list_display = ['__str__', 'title', 'author_name', len]
+
+    def changelist_view(self, request):
+        return [self.author_name(request)]
+
+    @short_description('Author')
+    def author_name(self, obj):
+        return obj
+
+
+class SampledGroupAdmin(PerformanceModelAdminMixin, ModelAdmin):
+
+    list_display = ['name', 'permission_total']
+    performance_sample_rate = 1.0
+    performance_n_plus_one_threshold = 3
+
+    def changelist_view(self, request, extra_context=None):
+        response = super(SampledGroupAdmin, self).changelist_view(
+            request, extra_context)
+        response.context_data['title'] = 'Sampled groups'
+        return response
+
+    @short_description('Permissions')
+    def permission_total(self, obj):
+        return obj.permissions.count()
+
+
+class PerformanceTest(unittest.TestCase):
+
+    def test_normalize_sql(self):
+        # Arrange
+        sql = ("SELECT * FROM \"book\" WHERE \"book\".\"id\" IN (%s, %s) "
+               "AND \"title\" = 'it''s' AND \"year\" > 2000")
+        # Act
+        result = normalize_sql(sql)
+        # Assert
+        self.assertEqual(result, 'SELECT * FROM "book" WHERE "book"."id" '
+                                 'IN (...) AND "title" = ? AND "year" > ?')
+
+    def test_sample(self):
+        # Arrange
+        sample = PerformanceSample('app.book:changelist')
+        execute = mock.Mock(return_value=mock.sentinel.cursor)
+        stats = PerformanceStats()
+        # Act
+        for i in range(3):
+            result = sample(execute, 'SELECT * FROM author WHERE id = %s',
+                            [i], False, {})
+        sample(execute, 'SELECT 1', None, False, {})
+        repeated = sample.repeated_queries(3)
+        stats.record(sample, repeated)
+        # Assert
+        self.assertEqual(result, mock.sentinel.cursor)
+        self.assertEqual(sample.query_count, 4)
+        self.assertEqual(repeated,
+                         {'SELECT * FROM author WHERE id = %s': 3})
+        view_stats = stats.as_dict()['app.book:changelist']
+        self.assertEqual(view_stats['count'], 1)
+        self.assertEqual(view_stats['query_count'], 4)
+        self.assertEqual(view_stats['n_plus_one'],
+                         {'SELECT * FROM author WHERE id = %s': 1})
+
+    def test_unsampled_view(self):
+        # Arrange
+        admin = PerformanceAdmin(mock.sentinel.queryset)
+        # Act
+        result = admin.changelist_view(mock.sentinel.request)
+        # Assert
+        self.assertEqual(result, [mock.sentinel.request])
+        self.assertEqual(admin.author_name.short_description, 'Author')
+        self.assertEqual(admin.list_display[:2], ['__str__', 'title'])
+        self.assertEqual(admin.list_display[3]('abc'), 3)
+        self.assertIn('author_name', vars(admin))
+        self.assertNotIn('__str__', vars(admin))
+
+    @unittest.skipUnless(_DJANGO, 'requires django')
+    def test_measured_view(self):
+        # Arrange
+        site = _setup_django()
+        from django.contrib.auth.models import Group
+        Group.objects.bulk_create([Group(name=name) for name in 'abcd'])
+        self.addCleanup(Group.objects.all().delete)
+        admin = SampledGroupAdmin(Group, site)
+        performance_stats.reset()
+        self.addCleanup(performance_stats.reset)
+        # Act
+        response = admin.changelist_view(_admin_request())
+        measured = performance_stats.as_dict()
+        with self.assertLogs('djhelpers.adminhelpers') as logs:
+            response.render()
+        # Assert
+        self.assertEqual(measured, {})
+        self.assertIn(b'Sampled groups', response.content)
+        stats = performance_stats.as_dict()['auth.group:changelist']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreater(stats['query_count'], 4)
+        self.assertIn('permission_total', stats['columns'])
+        self.assertEqual(len(stats['n_plus_one']), 1)
+        self.assertIn('"auth_group_permissions"',
+                      list(stats['n_plus_one'])[0])
+        self.assertIn('likely N+1, 4 times', logs.output[-1])
+
+
+class PkQuerySet(object):
+    '''
+    Queryset of primary keys, that records the executed queries.
+    '''
+
+    db = 'default'
+
+    def __init__(self, pks, queries=None):
+        self.pks = sorted(pks)
+        self.queries = [] if queries is None else queries
+
+    def order_by(self, field):
+        return PkQuerySet(self.pks, self.queries)
+
+    def filter(self, pk__gt=None, pk__in=None):
+        if pk__gt is not None:
+            return PkQuerySet([pk for pk in self.pks if pk > pk__gt],
+                              self.queries)
+        return PkQuerySet([pk for pk in self.pks if pk in pk__in],
+                          self.queries)
+
+    def values_list(self, field, flat=False):
+        return self
+
+    def __getitem__(self, item):
+        self.queries.append((self.pks[0] if self.pks else None, item.stop))
+        return PkQuerySet(self.pks[item], self.queries)
+
+    def iterator(self):
+        return iter(self.pks)
+
 
 class ActionDecoratorTest(unittest.TestCase):
     
@@ -63,6 +513,1388 @@ class ActionDecoratorTest(unittest.TestCase):
         self.assertEqual(len(actions), 1)
         self.assertEqual(_t.short_description, desc)
 
+    def test_chunked_admin_action(self):
+        # Arrange
+        actions = ActionDecorator()
+        # Act
+        @actions.action('chunked', chunk_size=100)
+        def recalculate(modeladmin, request, queryset):
+            return queryset
+        # Assert
+        self.assertEqual(actions, [recalculate])
+        self.assertEqual(recalculate.__name__, 'recalculate')
+        self.assertEqual(recalculate.short_description, 'chunked')
+        self.assertEqual(recalculate.chunk_size, 100)
+
+    def test_iter_batches(self):
+        # Arrange
+        queryset = PkQuerySet([5, 1, 9, 3, 7])
+        # Act
+        batches = [batch.pks for batch in iter_batches(queryset, 2)]
+        # Assert
+        self.assertEqual(batches, [[1, 3], [5, 7], [9]])
+        # every page starts after the last pk of the previous one and the
+        # short last page ends the paging without another query
+        self.assertEqual(queryset.queries, [(1, 2), (5, 2), (9, 2)])
+
+    def test_iter_batches_full_last_page(self):
+        # Arrange
+        queryset = PkQuerySet([1, 2, 3, 4])
+        # Act
+        batches = [batch.pks for batch in iter_batches(queryset, 2)]
+        # Assert
+        self.assertEqual(batches, [[1, 2], [3, 4]])
+        self.assertEqual(queryset.queries, [(1, 2), (3, 2), (None, 2)])
+
+    def test_chunked_action_transactions(self):
+        # Arrange
+        events = []
+
+        @contextlib.contextmanager
+        def atomic(using):
+            events.append(('begin', using))
+            yield
+            events.append('commit')
+
+        def recalculate(modeladmin, request, queryset):
+            events.append(queryset.pks)
+            return len(queryset.pks)
+        transaction = mock.Mock(atomic=atomic)
+        django_db = mock.Mock(transaction=transaction)
+        action = chunked_action(recalculate, 2)
+        # Act
+        with mock.patch.dict(sys.modules, {'django': mock.Mock(),
+                                           'django.db': django_db}):
+            result = action(None, mock.sentinel.request,
+                            PkQuerySet([1, 2, 3]))
+        # Assert
+        self.assertEqual(result, 1)
+        self.assertEqual(events, [('begin', 'default'), [1, 2], 'commit',
+                                  ('begin', 'default'), [3], 'commit'])
+
+    def test_background_admin_action(self):
+        # Arrange
+        backend = LocalJobBackend()
+        actions = ActionDecorator()
+        modeladmin = mock.Mock()
+
+        @actions.action('export', background=True, backend=backend)
+        def export(modeladmin, request, queryset):
+            current_job().set_progress(len(queryset), len(queryset))
+            return 'exported %d' % len(queryset)
+        # Act
+        result = export(modeladmin, mock.sentinel.request, [1, 2, 3])
+        job = backend.jobs()[0]
+        job.wait(5)
+        # Assert
+        self.assertIsNone(result)
+        message = modeladmin.message_user.call_args[0]
+        self.assertEqual(message[0], mock.sentinel.request)
+        self.assertIn(job.id, message[1])
+        status = job_status(job.id, backend)
+        self.assertEqual(status['status'], Job.DONE)
+        self.assertEqual(status['result'], 'exported 3')
+        self.assertEqual((status['progress'], status['total']), (3, 3))
+        backend.shutdown()
+
+    def test_failed_background_job(self):
+        # Arrange
+        backend = LocalJobBackend()
+        # Act
+        job = backend.submit('failing', lambda: 1 / 0)
+        job.wait(5)
+        # Assert
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('ZeroDivisionError', job.error)
+        self.assertIsNone(job_status('unknown', backend))
+        backend.shutdown()
+
+    def test_background_job_closes_old_connections(self):
+        # Arrange
+        backend = LocalJobBackend()
+        events = []
+        django_db = mock.Mock()
+        django_db.close_old_connections.side_effect = \
+            lambda: events.append('close')
+        django_conf = mock.Mock()
+        # Act
+        with mock.patch.dict(sys.modules, {'django': mock.Mock(),
+                                           'django.conf': django_conf,
+                                           'django.db': django_db}):
+            django_conf.settings.configured = True
+            job = backend.submit('job', events.append, 'run')
+            job.wait(5)
+            django_conf.settings.configured = False
+            unconfigured = backend.submit('unconfigured', events.append,
+                                          'run')
+            unconfigured.wait(5)
+            backend.shutdown()
+        # Assert
+        self.assertEqual(events, ['close', 'run', 'close', 'run'])
+        self.assertEqual(unconfigured.status, Job.DONE)
+
+    def test_process_pool_job_status(self):
+        # Arrange
+        executor = mock.Mock(spec=ProcessPoolExecutor)
+        future = executor.submit.return_value
+        future.running.return_value = False
+        future.exception.return_value = None
+        future.result.return_value = 'done'
+        backend = LocalJobBackend(executor)
+        job = backend.submit('job', len, [1])
+        # Act
+        queued = job_status(job.id, backend)['status']
+        future.running.return_value = True
+        running = job_status(job.id, backend)['status']
+        future.add_done_callback.call_args[0][0](future)
+        # Assert
+        self.assertEqual(queued, Job.QUEUED)
+        self.assertEqual(running, Job.RUNNING)
+        self.assertEqual(job_status(job.id, backend)['status'], Job.DONE)
+
+    def test_running_jobs_are_kept(self):
+        # Arrange
+        backend = LocalJobBackend(max_workers=1, max_jobs=1)
+        release = threading.Event()
+        running = backend.submit('running', release.wait, 5)
+        queued = backend.submit('queued', lambda: None)
+        kept = backend.jobs()
+        release.set()
+        queued.wait(5)
+        # Act
+        newest = backend.submit('newest', lambda: None)
+        # Assert
+        self.assertEqual(kept, [running, queued])
+        self.assertEqual(backend.jobs(), [newest])
+        backend.shutdown()
+
+
+class Service(object):
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class ApplicationContextTest(unittest.TestCase):
+
+    def test_prototype_get(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('dep', Service)
+        context.register('obj', Service,
+                         args=[mock.sentinel.arg, Inject('dep')],
+                         kwargs={'deps': [Inject('dep'), {'d': Inject('dep')}],
+                                 'const': [mock.sentinel.const]},
+                         scope=ObjectDefinition.SCOPE_PROTOTYPE)
+        # Act
+        first = context.get('obj')
+        second = context.get('obj')
+        # Assert
+        self.assertIsNot(first, second)
+        dep = context.get('dep')
+        self.assertEqual(first.args, (mock.sentinel.arg, dep))
+        self.assertEqual(first.kwargs['deps'], [dep, {'d': dep}])
+        self.assertIs(first.kwargs['const'], second.kwargs['const'])
+
+    def test_legacy_singleton_flag(self):
+        # Arrange
+        context = ApplicationContext()
+        # Act
+        context.register('single', Service, None, None, None, True)
+        context.register('proto', Service, None, None, None, False)
+        context.register('keyword', Service, singelton=False)
+        # Assert
+        self.assertIs(context.get('single'), context.get('single'))
+        self.assertIsNot(context.get('proto'), context.get('proto'))
+        self.assertIsNot(context.get('keyword'), context.get('keyword'))
+        self.assertEqual(context._get_object_def('keyword').options, {})
+
+    def test_unknown_option(self):
+        # Arrange
+        context = ApplicationContext()
+        # Act & Assert
+        with self.assertRaises(TypeError):
+            context.register('obj', Service, pool_sise=3)
+        with self.assertRaises(ConfigurationError):
+            parse_config([{'id': 'obj', 'factory': 'os.getcwd', 'tll': 1}])
+
+    def test_concurrent_singleton_creation(self):
+        # Arrange
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.01)
+            return Service()
+        context = ApplicationContext()
+        context.register('slow', factory)
+        context.register('obj', Service, args=[Inject('slow')])
+        barrier = threading.Barrier(16)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(context.get('obj'))
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Assert
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 16)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_load_config_detects_cycles(self):
+        # Arrange
+        config = [('a', Service, [Inject('b')]),
+                  ('b', Service, [[Inject('c')]]),
+                  ('c', Service, None, {'a': Inject('a')})]
+        # Act & Assert
+        with self.assertRaises(CircularDependencyError) as cm:
+            ApplicationContext(config)
+        self.assertEqual(len(cm.exception.cycle), 4)
+        self.assertEqual(cm.exception.cycle[0], cm.exception.cycle[-1])
+
+    def test_load_config_detects_missing_ids(self):
+        # Arrange
+        config = [('a', Service, [Inject('missing')])]
+        # Act & Assert
+        with self.assertRaises(ObjectDefinitionNotFound):
+            ApplicationContext(config)
+
+    def test_parallel_warm_up(self):
+        # Arrange
+        created = []
+
+        def factory(*args):
+            created.append(threading.current_thread())
+            return Service(*args)
+        config = [('root', factory, [Inject('a'), Inject('b')]),
+                  ('a', factory, [Inject('leaf')]),
+                  ('b', factory, [Inject('leaf')]),
+                  ('leaf', factory),
+                  ('proto', factory, None, None, None,
+                   ObjectDefinition.SCOPE_PROTOTYPE)]
+        context = ApplicationContext(config)
+        # Act
+        context.warm_up(parallel=2)
+        # Assert
+        self.assertEqual(len(created), 4)
+        self.assertNotIn(threading.current_thread(), created)
+        root = context.get('root')
+        self.assertIs(root.args[0].args[0], context.get('leaf'))
+        self.assertEqual(len(created), 4)
+
+    def test_lazy_inject(self):
+        # Arrange
+        factory = mock.Mock(return_value=Service(mock.sentinel.arg))
+        config = [('obj', Service, [LazyInject('dep')]),
+                  ('dep', factory, [Inject('obj')])]
+        context = ApplicationContext(config)
+        # Act
+        proxy = context.get('obj').args[0]
+        factory.assert_not_called()
+        args = proxy.args
+        # Assert
+        self.assertEqual(args, (mock.sentinel.arg,))
+        self.assertIsInstance(proxy, Service)
+        self.assertEqual(factory.call_count, 1)
+
+    def test_lazy_proxy_protocols(self):
+        # Arrange
+        lock = threading.Lock()
+        context = ApplicationContext([('number', int, [5]),
+                                      ('lock', lambda: lock),
+                                      ('obj', Service, [LazyInject('number'),
+                                                        LazyInject('lock')])])
+        number, lock_proxy = context.get('obj').args
+        # Act
+        with lock_proxy:
+            locked = lock.locked()
+        # Assert
+        self.assertTrue(locked)
+        self.assertFalse(lock.locked())
+        self.assertTrue(number <= 5)
+        self.assertTrue(number >= 5)
+        self.assertFalse(number < 5)
+
+    def test_lazy_proxy_concurrent_resolve(self):
+        # Arrange
+        created = []
+        other = []
+
+        def get(object_id):
+            obj = Service(len(created))
+            created.append(obj)
+            if len(created) == 1:
+                # another thread resolves the proxy in the meantime
+                thread = threading.Thread(
+                    target=lambda: other.append(proxy.args))
+                thread.start()
+                thread.join()
+            return obj
+        proxy = LazyProxy(mock.Mock(get=get), 'dep')
+        # Act
+        args = proxy.args
+        # Assert
+        self.assertEqual(other, [(1,)])
+        self.assertEqual(args, (1,))
+        self.assertEqual(proxy.args, (1,))
+        self.assertIsNone(proxy._ioc_container)
+
+    def test_aget(self):
+        # Arrange
+        calls = []
+
+        async def connect(*args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return Service(*args)
+        config = [('client', connect),
+                  ('obj', connect, [Inject('client'), Inject('sync')],
+                   None, None, ObjectDefinition.SCOPE_PROTOTYPE),
+                  ('sync', Service)]
+        context = ApplicationContext(config)
+
+        async def run():
+            return await asyncio.gather(context.aget('obj'),
+                                        context.aget('obj'))
+        # Act
+        first, second = asyncio.run(run())
+        # Assert
+        self.assertIsNot(first, second)
+        self.assertIs(first.args[0], second.args[0])
+        self.assertIs(first.args[0], context.get('client'))
+        self.assertIs(first.args[1], context.get('sync'))
+        self.assertEqual(len(calls), 3)
+
+    def test_stats(self):
+        # Arrange
+        context = ApplicationContext([
+            ('single', Service),
+            ('proto', Service, [Inject('single')], None, None,
+             ObjectDefinition.SCOPE_PROTOTYPE)])
+        context.enable_stats()
+        # Act
+        context.get('proto')
+        context.get('proto')
+        with self.assertRaises(ObjectDefinitionNotFound):
+            context.get('missing')
+        stats = context.stats()
+        context.reset_stats()
+        # Assert
+        self.assertEqual(stats['single']['misses'], 1)
+        self.assertEqual(stats['single']['hits'], 1)
+        self.assertEqual(stats['single']['created'], 1)
+        self.assertEqual(stats['proto']['created'], 2)
+        self.assertEqual(stats['proto']['hits'], 0)
+        self.assertNotIn('missing', stats)
+        self.assertGreaterEqual(stats['proto']['total_time'],
+                                stats['proto']['max_time'])
+        self.assertEqual(context.stats(), {})
+        context.disable_stats()
+        self.assertNotIn('get', vars(context))
+
+    def test_get_many(self):
+        # Arrange
+        factory = mock.Mock(side_effect=Service)
+        context = ApplicationContext([
+            ('shared', factory, None, None, None,
+             ObjectDefinition.SCOPE_PROTOTYPE),
+            ('a', Service, [Inject('shared')], None, None,
+             ObjectDefinition.SCOPE_PROTOTYPE),
+            ('b', Service, [Inject('shared'), Inject('single')], None, None,
+             ObjectDefinition.SCOPE_PROTOTYPE),
+            ('c', Service, [Inject('a')], None, None,
+             ObjectDefinition.SCOPE_PROTOTYPE),
+            ('single', Service)])
+        # Act
+        objects = context.get_many(['a', 'b', 'c', 'single'])
+        # Assert
+        self.assertEqual(set(objects), set(['a', 'b', 'c', 'single']))
+        self.assertIs(objects['a'].args[0], objects['b'].args[0])
+        self.assertIs(objects['c'].args[0], objects['a'])
+        self.assertIs(objects['b'].args[1], context.get('single'))
+        self.assertIs(objects['single'], context.get('single'))
+        self.assertEqual(factory.call_count, 1)
+
+    def test_trace(self):
+        # Arrange
+        context = ApplicationContext([
+            ('leaf', Service),
+            ('a', Service, [Inject('leaf')]),
+            ('root', Service, [Inject('a'), Inject('leaf')])])
+        # Act
+        with context.trace() as tracer:
+            context.get('root')
+        # Assert
+        self.assertNotIn('_create', vars(context))
+        tree = tracer.as_tree()
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree[0]['id'], 'root')
+        self.assertEqual(tree[0]['children'][0]['id'], 'a')
+        self.assertEqual(tree[0]['children'][0]['children'][0]['id'], 'leaf')
+        self.assertEqual(json.loads(tracer.to_json()), tree)
+        stacks = [line.rsplit(' ', 1)[0]
+                  for line in tracer.collapsed_stacks().splitlines()]
+        self.assertEqual(sorted(stacks), ['root', 'root;a', 'root;a;leaf'])
+
+    def test_enable_stats_while_tracing(self):
+        # Arrange
+        context = ApplicationContext([
+            ('proto', Service, None, None, None,
+             ObjectDefinition.SCOPE_PROTOTYPE)])
+        # Act
+        with context.trace():
+            context.enable_stats()
+        context.get('proto')
+        # Assert
+        self.assertEqual(context.stats()['proto']['created'], 1)
+
+    def test_get_async_factory(self):
+        # Arrange
+        async def connect():
+            return Service()
+        context = ApplicationContext([('client', connect)])
+        # Act & Assert
+        with self.assertRaises(AppContextError):
+            context.get('client')
+
+
+class Mailer(object):
+
+    def __init__(self, service: Service, name, sender: 'Cart', *,
+                 repo: Service, retries: int = 3):
+        self.service = service
+        self.name = name
+        self.sender = sender
+        self.repo = repo
+        self.retries = retries
+
+
+class AutowireTest(unittest.TestCase):
+
+    def test_autowire(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register(Service, Service)
+        context.register(Cart, Cart)
+        # Act
+        context.register('mailer', Mailer, [mock.sentinel.service, 'name'],
+                         autowire=True)
+        # Assert
+        mailer = context.get('mailer')
+        self.assertIs(mailer.service, mock.sentinel.service)
+        self.assertIs(mailer.sender, context.get(Cart))
+        self.assertIs(mailer.repo, context.get(Service))
+        self.assertEqual(mailer.retries, 3)
+
+    def test_autowire_introspection_is_cached(self):
+        # Arrange
+        ApplicationContext().register('mailer', Mailer, autowire=True)
+        # Act
+        with mock.patch('inspect.signature') as signature:
+            ApplicationContext().register('mailer', Mailer, autowire=True)
+        # Assert
+        signature.assert_not_called()
+
+
+class FrozenApplicationContextTest(unittest.TestCase):
+
+    def test_freeze(self):
+        # Arrange
+        context = ApplicationContext([
+            ('single', Service),
+            ('proto', Service, [Inject('single'), [Inject('single')]], None,
+             None, ObjectDefinition.SCOPE_PROTOTYPE),
+            ('pool', Service, None, None, None,
+             ObjectDefinition.SCOPE_POOLED)])
+        single = context.get('single')
+        # Act
+        frozen = context.freeze()
+        # Assert
+        self.assertIs(frozen.get('single'), single)
+        proto = frozen.get('proto')
+        self.assertEqual(proto.args, (single, [single]))
+        self.assertIsNot(proto, frozen.get('proto'))
+        handle = frozen.get_handle('pool')
+        self.assertIs(frozen.get_by_handle(handle), context.get('pool'))
+        self.assertIs(frozen.accessor('single')(), single)
+        self.assertIsInstance(frozen.accessor('proto')(), Service)
+        self.assertEqual(frozen.get_scope('proto'),
+                         ObjectDefinition.SCOPE_PROTOTYPE)
+        with self.assertRaises(ObjectDefinitionNotFound):
+            frozen.get('missing')
+        with self.assertRaises(FrozenContextError):
+            frozen.register('new', Service)
+        with self.assertRaises(FrozenContextError):
+            context.register('new', Service)
+
+
+class ChildApplicationContextTest(unittest.TestCase):
+
+    def test_overrides(self):
+        # Arrange
+        parent = ApplicationContext([
+            ('db', Service, ['parent']),
+            ('repo', Service, [Inject('db')]),
+            ('cache', Service),
+            ('other', Service, [Inject('cache')])])
+        # Act
+        child = parent.child([('db', Service, ['child'])])
+        grandchild = ChildApplicationContext(child)
+        # Assert
+        self.assertEqual(child.get('db').args, ('child',))
+        self.assertIs(child.get('repo').args[0], child.get('db'))
+        self.assertIsNot(child.get('repo'), parent.get('repo'))
+        self.assertIs(child.get('other'), parent.get('other'))
+        self.assertEqual(parent.get('repo').args[0].args, ('parent',))
+        self.assertIs(grandchild.get('repo'), child.get('repo'))
+        self.assertEqual(child.get_scope('cache'),
+                         ObjectDefinition.SCOPE_SINGLETON)
+        self.assertEqual(set(child.dependency_graph()),
+                         set(['db', 'repo', 'cache', 'other']))
+        self.assertEqual(len(child._config), 1)
+
+    def test_lookup_skips_the_hierarchy(self):
+        # Arrange
+        root = ApplicationContext([
+            ('db', Service, ['root']),
+            ('repo', Service, [Inject('db')]),
+            ('cache', Service)])
+        contexts = [root.child([('db', Service, ['child'])])]
+        for i in range(4):
+            contexts.append(contexts[-1].child([('x%d' % i, Service)]))
+        owner = contexts[0]
+        owner.get = mock.Mock(wraps=owner.get)
+        for context in contexts[1:-1]:
+            context.get = mock.Mock(side_effect=AssertionError)
+        # Act
+        repo = contexts[-1].get('repo')
+        cache = contexts[-1].get('cache')
+        # Assert
+        self.assertEqual(repo.args[0].args, ('child',))
+        self.assertEqual(owner.get.call_args_list[0], mock.call('repo'))
+        self.assertIs(cache, root.get('cache'))
+        self.assertEqual(contexts[-1]._get_local_ids(), frozenset(['x3']))
+
+    def test_child_size_is_independent_of_the_parent(self):
+        # Arrange
+        def child_size(size):
+            root = ApplicationContext(
+                [(i, Service, [Inject(i - 1)] if i else None)
+                 for i in range(size)])
+            root.child([('warm up', Service)])
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                child = root.child([(size - 1, Service, [Inject(0)])])
+                return child, tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+        # Act
+        _, small = child_size(50)
+        child, large = child_size(2000)
+        # Assert
+        self.assertLess(large - small, 1024)
+        self.assertEqual(child._get_local_ids(), frozenset([1999]))
+
+    def test_child_validation(self):
+        # Arrange
+        parent = ApplicationContext([
+            ('a', Service), ('b', Service, [Inject('a')])])
+        # Act & Assert
+        with self.assertRaises(CircularDependencyError):
+            parent.child([('a', Service, [Inject('b')])])
+        with self.assertRaises(ObjectDefinitionNotFound):
+            parent.child([('a', Service, [Inject('missing')])])
+
+
+class DeclarativeConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.tmp_dir, 'config.json')
+        with open(self.config_path, 'w') as config_file:
+            json.dump([
+                {'id': 'repo', 'factory': 'djhelpers.tests.Service',
+                 'args': [{'inject': 'db'}, [1, {'inject': 'db'}]],
+                 'kwargs': {'lazy_db': {'inject': 'db', 'lazy': True}},
+                 'scope': 'prototype'},
+                {'id': 'db', 'factory': 'djhelpers.tests.Service',
+                 'kwargs': {'name': 'db'}, 'dispose': 'close'},
+            ], config_file)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_json_config(self):
+        # Arrange
+        context = ApplicationContext()
+        # Act
+        context.load_json_config(self.config_path)
+        # Assert
+        factory = context._get_object_def('repo').factory
+        self.assertIsInstance(factory, LazyFactory)
+        self.assertIsNone(factory._target)
+        repo = context.get('repo')
+        db = context.get('db')
+        self.assertIsInstance(repo, Service)
+        self.assertEqual(repo.args, (db, [1, db]))
+        self.assertEqual(repo.kwargs['lazy_db'].kwargs, {'name': 'db'})
+        self.assertEqual(context._get_object_def('db').options,
+                         {'dispose': 'close'})
+
+    def test_compiled_config_cache(self):
+        # Arrange
+        ApplicationContext().load_json_config(self.config_path,
+                                              self.cache_dir)
+        context = ApplicationContext()
+        # Act
+        with mock.patch('djhelpers.ioc.parse_config') as parse_config:
+            context.load_json_config(self.config_path, self.cache_dir)
+        # Assert
+        parse_config.assert_not_called()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertIsInstance(context.get('repo'), Service)
+
+    def test_compiled_config_cache_format_version(self):
+        # Arrange
+        ApplicationContext().load_json_config(self.config_path,
+                                              self.cache_dir)
+        context = ApplicationContext()
+        # Act
+        with mock.patch('djhelpers.ioc.COMPILED_FORMAT_VERSION', 999):
+            context.load_json_config(self.config_path, self.cache_dir)
+        # Assert
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertTrue(any('_v999_' in name
+                            for name in os.listdir(self.cache_dir)))
+
+    def test_load_settings_config(self):
+        # Arrange
+        settings = mock.Mock(APP_CONTEXT_CONFIG=[
+            {'id': 'db', 'factory': Service, 'args': [1]}],
+            APP_CONTEXT_CACHE_DIR=self.cache_dir)
+        context = ApplicationContext()
+        # Act
+        context.load_settings_config(settings)
+        # Assert
+        self.assertEqual(context.get('db').args, (1,))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+def _private_dirty():
+    '''
+    Returns the private, modified memory of the process in bytes.
+    '''
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+class PreforkTest(unittest.TestCase):
+
+    def tearDown(self):
+        gc.unfreeze()
+
+    def _create_context(self):
+        context = ApplicationContext([(i, bytearray, [10000])
+                                      for i in range(100)])
+        context.register('socket', mock.Mock, fork_safe=False)
+        context.register('client', Service, [Inject('socket')])
+        return context
+
+    def _worker_allocation(self, context):
+        '''
+        Returns the bytes a forked worker allocates to get all objects.
+        '''
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            import tracemalloc
+            tracemalloc.start()
+            for i in range(100):
+                context.get(i)
+            allocated = tracemalloc.get_traced_memory()[0]
+            os.write(write_fd, str(allocated).encode('ascii'))
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as result:
+            allocated = int(result.read())
+        os.waitpid(pid, 0)
+        return allocated
+
+    def test_prefork_creates_singletons_in_master(self):
+        # Arrange
+        cold = self._create_context()
+        warm = self._create_context()
+        # Act
+        warm.prefork()
+        cold_allocation = self._worker_allocation(cold)
+        warm_allocation = self._worker_allocation(warm)
+        # Assert
+        self.assertGreater(cold_allocation - warm_allocation, 100 * 10000)
+        self.assertNotIn('socket', warm._singeltons)
+        self.assertNotIn('client', warm._singeltons)
+        self.assertIn(0, warm._singeltons)
+
+    def _gc_private_growth(self):
+        '''
+        Returns the bytes of shared pages, that a full garbage collection
+        in a forked worker copies into private memory.
+        '''
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            before = _private_dirty()
+            gc.collect()
+            growth = _private_dirty() - before
+            os.write(write_fd, str(growth).encode('ascii'))
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as result:
+            growth = int(result.read())
+        os.waitpid(pid, 0)
+        return growth
+
+    @unittest.skipUnless(os.path.exists('/proc/self/smaps_rollup'),
+                         'requires /proc/self/smaps_rollup')
+    def test_prefork_keeps_worker_pages_shared(self):
+        # Arrange
+        def create_context():
+            return ApplicationContext([
+                (i, list, [[[j] for j in range(1000)]]) for i in range(100)])
+        warm = create_context()
+        warm.warm_up()
+        frozen = create_context()
+        # Act
+        warm_growth = self._gc_private_growth()
+        frozen.prefork()
+        frozen_growth = self._gc_private_growth()
+        # Assert
+        # the lists of the contexts stay on pages shared with the master,
+        # unless the collector of the worker writes to their headers
+        self.assertGreater(warm_growth - frozen_growth, 4 * 1024 * 1024)
+
+    def test_fork_unsafe_objects_are_dropped_in_child(self):
+        # Arrange
+        context = self._create_context()
+        context.get('client')
+        context.prefork()
+        read_fd, write_fd = os.pipe()
+        # Act
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            dropped = 'client' not in context._singeltons and \
+                'socket' not in context._singeltons and \
+                0 in context._singeltons
+            os.write(write_fd, b'1' if dropped else b'0')
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as result:
+            dropped = result.read()
+        os.waitpid(pid, 0)
+        # Assert
+        self.assertEqual(dropped, b'1')
+        self.assertIn('client', context._singeltons)
+
+    def test_fork_unsafe_objects_are_dropped_in_frozen_child(self):
+        # Arrange
+        context = self._create_context()
+        context.register('pool', Service,
+                         scope=ObjectDefinition.SCOPE_POOLED)
+        frozen = context.freeze()
+        socket_handle = frozen.get_handle('socket')
+        socket = frozen.get_by_handle(socket_handle)
+        client = frozen.accessor('client')
+        pool = frozen.get('pool')
+        context.prefork()
+        read_fd, write_fd = os.pipe()
+        # Act
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            dropped = frozen.get_by_handle(socket_handle) is not socket and \
+                client().args[0] is not socket and \
+                frozen.get('pool') is not pool
+            os.write(write_fd, b'1' if dropped else b'0')
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as result:
+            dropped = result.read()
+        os.waitpid(pid, 0)
+        # Assert
+        self.assertEqual(dropped, b'1')
+        self.assertIs(frozen.get_by_handle(socket_handle), socket)
+
+
+class RuntimeArgumentsTest(unittest.TestCase):
+
+    def test_runtime_arguments(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('dep', Service)
+        context.register('formatter', Service, [Inject('dep')],
+                         {'locale': 'en', 'digits': 2},
+                         scope=ObjectDefinition.SCOPE_PROTOTYPE)
+        # Act
+        formatter = context.get('formatter', 'EUR', locale='de')
+        # Assert
+        self.assertEqual(formatter.args, (context.get('dep'), 'EUR'))
+        self.assertEqual(formatter.kwargs, {'locale': 'de', 'digits': 2})
+        self.assertEqual(context.get('formatter').args,
+                         (context.get('dep'),))
+        with self.assertRaises(AppContextError):
+            context.get('dep', 'EUR')
+
+    def test_memoize(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('formatter', Service,
+                         scope=ObjectDefinition.SCOPE_PROTOTYPE, memoize=2)
+        eur = context.get('formatter', 'EUR')
+        # Act
+        cached = context.get('formatter', 'EUR')
+        context.get('formatter', 'USD')
+        context.get('formatter', 'CHF')
+        evicted = context.get('formatter', 'EUR')
+        unhashable = context.get('formatter', ['EUR'])
+        # Assert
+        self.assertIs(eur, cached)
+        self.assertIsNot(eur, evicted)
+        self.assertIsNot(unhashable, context.get('formatter', ['EUR']))
+        self.assertIsNot(context.get('formatter'),
+                         context.get('formatter'))
+
+    def test_frozen_runtime_arguments(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('dep', Service)
+        context.register('formatter', Service, [Inject('dep')],
+                         {'locale': 'en'},
+                         scope=ObjectDefinition.SCOPE_PROTOTYPE, memoize=2)
+        frozen = context.freeze()
+        # Act
+        formatter = frozen.get('formatter', 'EUR', locale='de')
+        # Assert
+        self.assertEqual(formatter.args, (frozen.get('dep'), 'EUR'))
+        self.assertEqual(formatter.kwargs, {'locale': 'de'})
+        self.assertIs(formatter, frozen.get('formatter', 'EUR', locale='de'))
+        self.assertEqual(frozen.get('formatter').kwargs, {'locale': 'en'})
+        with self.assertRaises(AppContextError):
+            frozen.get('dep', 'EUR')
+
+
+class CacheScopeTest(unittest.TestCase):
+
+    def test_expiring_scope(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('flags', Service,
+                         scope=ObjectDefinition.SCOPE_EXPIRING, ttl=0.05)
+        first = context.get('flags')
+        # Act
+        cached = context.get('flags')
+        time.sleep(0.06)
+        expired = context.get('flags')
+        # Assert
+        self.assertIs(first, cached)
+        self.assertIsNot(first, expired)
+
+    def test_refresh_ahead(self):
+        # Arrange
+        calls = []
+
+        def factory():
+            calls.append(1)
+            if len(calls) > 1:
+                time.sleep(0.1)
+            return Service(len(calls))
+        context = ApplicationContext()
+        context.register('flags', factory,
+                         scope=ObjectDefinition.SCOPE_EXPIRING,
+                         ttl=0.05, refresh_ahead=0.04)
+        first = context.get('flags')
+        time.sleep(0.02)
+        # Act
+        started = time.time()
+        stale = context.get('flags')
+        also_stale = context.get('flags')
+        elapsed = time.time() - started
+        context._refresh_executor.shutdown(wait=True)
+        # Assert
+        self.assertLess(elapsed, 0.05)
+        self.assertIs(stale, first)
+        self.assertIs(also_stale, first)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(context.get('flags').args, (2,))
+
+    def test_failed_refresh_ahead_expires(self):
+        # Arrange
+        calls = []
+
+        def factory():
+            calls.append(1)
+            if len(calls) == 2:
+                raise ValueError('refresh failed')
+            return Service(len(calls))
+        context = ApplicationContext()
+        context.register('token', factory,
+                         scope=ObjectDefinition.SCOPE_EXPIRING,
+                         ttl=0.05, refresh_ahead=0.04)
+        first = context.get('token')
+        time.sleep(0.02)
+        with mock.patch('djhelpers.ioc.logger'):
+            self.assertIs(context.get('token'), first)
+            context._refresh_executor.shutdown(wait=True)
+        time.sleep(0.04)
+        # Act
+        token = context.get('token')
+        # Assert
+        self.assertEqual(token.args, (3,))
+
+    def test_refresh_after_reset(self):
+        # Arrange
+        started = threading.Event()
+        release = threading.Event()
+
+        def factory():
+            if context._expiring:
+                started.set()
+                release.wait(5)
+            return Service()
+        context = ApplicationContext()
+        context.register('flags', factory,
+                         scope=ObjectDefinition.SCOPE_EXPIRING,
+                         ttl=10, refresh_ahead=10)
+        context.get('flags')
+        context.get('flags')
+        started.wait(5)
+        # Act
+        context.reset()
+        release.set()
+        context._refresh_executor.shutdown(wait=True)
+        # Assert
+        self.assertEqual(context._expiring, {})
+
+    def test_expiring_scope_requires_ttl(self):
+        # Act & Assert
+        with self.assertRaises(TypeError):
+            ApplicationContext().register(
+                'flags', Service, scope=ObjectDefinition.SCOPE_EXPIRING)
+
+    def test_lru_scope(self):
+        # Arrange
+        context = ApplicationContext()
+        context.lru_size = 2
+        for object_id in ('a', 'b', 'c'):
+            context.register(object_id, Service,
+                             scope=ObjectDefinition.SCOPE_LRU)
+        a = context.get('a')
+        b = context.get('b')
+        # Act
+        context.get('a')
+        context.get('c')
+        # Assert
+        self.assertIs(context.get('a'), a)
+        self.assertIsNot(context.get('b'), b)
+
+
+class ThreadAndContextScopeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = ApplicationContext()
+        self.context.register('thread', mock.Mock,
+                              scope=ObjectDefinition.SCOPE_THREAD,
+                              dispose='close')
+        self.context.register('ctx', mock.Mock,
+                              scope=ObjectDefinition.SCOPE_CONTEXT,
+                              dispose='close')
+
+    def test_thread_scope(self):
+        # Arrange
+        results = []
+
+        def worker():
+            results.append(self.context.get('thread'))
+            results.append(self.context.get('thread'))
+        thread = threading.Thread(target=worker)
+        # Act
+        thread.start()
+        thread.join()
+        del thread
+        gc.collect()
+        # Assert
+        self.assertIs(results[0], results[1])
+        self.assertIsNot(results[0], self.context.get('thread'))
+        results[0].close.assert_called_once_with()
+
+    def test_context_scope(self):
+        # Arrange
+        async def task():
+            first = await self.context.aget('ctx')
+            await asyncio.sleep(0)
+            self.assertIs(first, self.context.get('ctx'))
+            return first
+
+        async def run():
+            return await asyncio.gather(task(), task())
+        # Act
+        first, second = asyncio.run(run())
+        with self.context.context_scope():
+            scoped = self.context.get('ctx')
+            self.assertIs(scoped, self.context.get('ctx'))
+        # Assert
+        self.assertIsNot(first, second)
+        self.assertIsNot(scoped, self.context.get('ctx'))
+        scoped.close.assert_called_once_with()
+
+    def test_context_scope_of_collected_context(self):
+        # Arrange
+        contexts = [ApplicationContext() for _ in range(3)]
+        for context in contexts:
+            context.register('ctx', mock.Mock,
+                             scope=ObjectDefinition.SCOPE_CONTEXT,
+                             dispose='close')
+        objs = [context.get('ctx') for context in contexts]
+        ref = weakref.ref(contexts[0])
+        # Act
+        del contexts[0]
+        gc.collect()
+        # Assert
+        self.assertIsNone(ref())
+        objs[0].close.assert_called_once_with()
+        self.assertEqual(len(set(map(id, objs))), 3)
+        self.assertIs(contexts[0].get('ctx'), objs[1])
+        self.assertIs(contexts[1].get('ctx'), objs[2])
+
+    def test_reset_disposes_scope_stores(self):
+        # Arrange
+        thread_obj = self.context.get('thread')
+        ctx_obj = self.context.get('ctx')
+        results = []
+        ready = threading.Event()
+        done = threading.Event()
+
+        def worker():
+            results.append(self.context.get('thread'))
+            ready.set()
+            done.wait()
+            results.append(self.context.get('thread'))
+        thread = threading.Thread(target=worker)
+        thread.start()
+        ready.wait()
+        # Act
+        self.context.reset()
+        self.context.register('thread', mock.Mock,
+                              scope=ObjectDefinition.SCOPE_THREAD)
+        self.context.register('ctx', mock.Mock,
+                              scope=ObjectDefinition.SCOPE_CONTEXT)
+        done.set()
+        thread.join()
+        # Assert
+        thread_obj.close.assert_called_once_with()
+        ctx_obj.close.assert_called_once_with()
+        self.assertIsNot(thread_obj, self.context.get('thread'))
+        self.assertIsNot(ctx_obj, self.context.get('ctx'))
+        self.assertIsNot(results[0], results[1])
+        results[0].close.assert_called_once_with()
+
+
+class ObjectPoolTest(unittest.TestCase):
+
+    def test_pooled_scope(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('client', Service, [Inject('dep')],
+                         scope=ObjectDefinition.SCOPE_POOLED, pool_size=2)
+        context.register('dep', Service)
+        pool = context.get('client')
+        # Act
+        with pool.item() as first:
+            with pool.item() as second:
+                stats = pool.stats()
+        with pool.item() as third:
+            pass
+        # Assert
+        self.assertIsInstance(pool, ObjectPool)
+        self.assertIs(pool, context.get('client'))
+        self.assertIsNot(first, second)
+        self.assertIs(third, first)
+        self.assertIs(first.args[0], context.get('dep'))
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(pool.stats()['created'], 2)
+        self.assertEqual(pool.stats()['idle'], 2)
+
+    def test_checkout_timeout(self):
+        # Arrange
+        pool = ObjectPool(Service, max_size=1, timeout=0.01)
+        obj = pool.checkout()
+        # Act & Assert
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+        pool.checkin(obj)
+        self.assertIs(pool.checkout(), obj)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_idle_eviction(self):
+        # Arrange
+        dispose = mock.Mock()
+        pool = ObjectPool(Service, idle_timeout=0, dispose=dispose)
+        obj = pool.checkout()
+        pool.checkin(obj)
+        time.sleep(0.001)
+        # Act
+        pool.evict_idle()
+        # Assert
+        dispose.assert_called_once_with(obj)
+        self.assertEqual(pool.stats()['size'], 0)
+
+
+class ApplicationContextMiddlewareTest(unittest.TestCase):
+
+    def test_request_scope(self):
+        # Arrange
+        context = ApplicationContext()
+        context.register('single', Service)
+        context.register('req', mock.Mock, scope=ObjectDefinition.SCOPE_REQUEST,
+                         dispose='close')
+        request = mock.Mock(spec=['session'])
+        results = []
+
+        def view(request):
+            results.append(request.app_context.get('req'))
+            results.append(request.app_context.get('req'))
+            results.append(request.app_context('single'))
+            return mock.sentinel.response
+        middleware = ApplicationContextMiddleware(view, context)
+        # Act
+        response = middleware(request)
+        # Assert
+        self.assertIs(response, mock.sentinel.response)
+        self.assertIs(results[0], results[1])
+        self.assertIs(results[2], context.get('single'))
+        results[0].close.assert_called_once_with()
+        self.assertFalse(request.session.method_calls)
+
+    def _async_view(self, results):
+        async def view(request):
+            results.append(await request.app_context.aget('req'))
+            (await request.app_context.aget('cart')).items.append(1)
+            return mock.sentinel.response
+        return view
+
+    def _async_context(self):
+        context = ApplicationContext()
+        context.register('req', mock.Mock, scope=ObjectDefinition.SCOPE_REQUEST,
+                         dispose='close')
+        context.register('cart', Cart, scope=ObjectDefinition.SCOPE_SESSION)
+        return context
+
+    def test_async_request(self):
+        # Arrange
+        results = []
+        request = mock.Mock(session=LoopCheckingSession())
+        middleware = ApplicationContextMiddleware(lambda r: None,
+                                                  self._async_context())
+        middleware.get_response = self._async_view(results)
+        # Act
+        response = asyncio.run(middleware.__acall__(request))
+        # Assert
+        self.assertIs(response, mock.sentinel.response)
+        results[0].close.assert_called_once_with()
+        self.assertEqual(len(request.session), 1)
+        self.assertEqual(request.session.loop_accesses, [])
+
+    def test_streaming_response(self):
+        # Arrange
+        context = self._async_context()
+        request = mock.Mock(spec=['session'])
+        response = mock.Mock(streaming=True)
+        close = response.close
+        results = []
+
+        def view(request):
+            results.append(request.app_context.get('req'))
+            return response
+        middleware = ApplicationContextMiddleware(view, context)
+        # Act
+        result = middleware(request)
+        disposed_before_close = results[0].close.called
+        result.close()
+        # Assert
+        self.assertFalse(disposed_before_close)
+        close.assert_called_once_with()
+        results[0].close.assert_called_once_with()
+
+    @unittest.skipUnless(_MARK_COROUTINE, 'needs python 3.12+ or asgiref')
+    def test_async_middleware(self):
+        # Arrange
+        results = []
+        request = mock.Mock(session={})
+        middleware = ApplicationContextMiddleware(self._async_view(results),
+                                                  self._async_context())
+        # Act
+        response = asyncio.run(middleware(request))
+        # Assert
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertIs(response, mock.sentinel.response)
+        results[0].close.assert_called_once_with()
+
+
+class LoopCheckingSession(dict):
+    '''
+    Session, that records the accesses from a running event loop.
+    '''
+
+    def __init__(self):
+        super(LoopCheckingSession, self).__init__()
+        self.loop_accesses = []
+
+    def _check(self, name):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.loop_accesses.append(name)
+
+    def get(self, *args):
+        self._check('get')
+        return super(LoopCheckingSession, self).get(*args)
+
+    def __setitem__(self, key, value):
+        self._check('set')
+        super(LoopCheckingSession, self).__setitem__(key, value)
+
+
+class Cart(object):
+
+    def __init__(self):
+        self.items = []
+
+
+class TupleCart(object):
+
+    def __init__(self):
+        self.items = ()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.items = tuple(self.items)
+
+
+class RepoCart(object):
+
+    def __init__(self, repo, prices):
+        self.items = []
+        self.repo = repo
+        self._prices = prices
+
+
+class SessionScopeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = ApplicationContext()
+        self.context.register('repo', Service)
+        self.context.register('prices', Service)
+        self.context.register('cart', Cart,
+                              scope=ObjectDefinition.SCOPE_SESSION)
+        self.context.register('repo_cart', RepoCart, [Inject('repo')],
+                              {'prices': LazyInject('prices')},
+                              scope=ObjectDefinition.SCOPE_SESSION)
+        self.context.register('pickled', Cart,
+                              scope=ObjectDefinition.SCOPE_SESSION,
+                              session_codec=PickleSessionCodec())
+        self.session = {}
+
+    def _request_context(self):
+        request = mock.Mock(session=mock.MagicMock(wraps=self.session))
+        request.session.get.side_effect = self.session.get
+        request.session.__setitem__.side_effect = self.session.__setitem__
+        return request, RequestApplicationContext(self.context, request)
+
+    def test_session_scope(self):
+        # Arrange
+        request, context = self._request_context()
+        # Act
+        context.get('cart').items.append(1)
+        context.get('pickled').items.append(2)
+        saved = context.save_session()
+        _, context = self._request_context()
+        cart = context.get('cart')
+        cart.items.append(3)
+        resaved = context.save_session()
+        # Assert
+        self.assertTrue(resaved)
+        self.assertTrue(saved)
+        self.assertEqual(self.session[RequestApplicationContext.SESSION_KEY]
+                         ['cart'], {'items': [1, 3]})
+        self.assertEqual(cart.items, [1, 3])
+        self.assertIsInstance(cart, Cart)
+        self.assertIs(cart, context.get('cart'))
+        self.assertEqual(context.get('pickled').items, [2])
+
+    def test_injected_dependencies_are_not_stored(self):
+        # Arrange
+        _, context = self._request_context()
+        context.get('repo_cart').items.append(1)
+        context.save_session()
+        _, context = self._request_context()
+        # Act
+        cart = context.get('repo_cart')
+        # Assert
+        state = self.session[RequestApplicationContext.SESSION_KEY][
+            'repo_cart']
+        self.assertEqual(state, {'items': [1], '__inject__': {
+            'repo': 'repo', '_prices': 'prices'}})
+        json.dumps(state)
+        self.assertEqual(cart.items, [1])
+        self.assertIs(cart.repo, self.context.get('repo'))
+        self.assertIs(cart._prices.args, self.context.get('prices').args)
+        self.assertFalse(context.save_session())
+
+    def test_unchanged_session_is_not_modified(self):
+        # Arrange
+        _, context = self._request_context()
+        context.get('cart').items.append(1)
+        context.save_session()
+        request, context = self._request_context()
+        # Act
+        context.get('cart')
+        saved = context.save_session()
+        # Assert
+        self.assertFalse(saved)
+        self.assertFalse(request.session.__setitem__.called)
+
+    def test_json_serialized_session_is_not_modified(self):
+        # Arrange
+        self.context.register('tuple_cart', TupleCart,
+                              scope=ObjectDefinition.SCOPE_SESSION)
+        _, context = self._request_context()
+        context.get('tuple_cart').items = (1, 2)
+        context.save_session()
+        # the session serializer turns tuples into lists
+        self.session.update(json.loads(json.dumps(self.session)))
+        request, context = self._request_context()
+        # Act
+        cart = context.get('tuple_cart')
+        saved = context.save_session()
+        # Assert
+        self.assertEqual(cart.items, (1, 2))
+        self.assertFalse(saved)
+        self.assertFalse(request.session.__setitem__.called)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().discover('.')
@@ -18,13 +18,15 @@ setup(
     keywords = "django helpers",
     url = "https://github.com/trunneml/djhelpers",
     packages=find_packages(exclude=['tests']),
+    install_requires=['Django>=2.0'],
+    extras_require={'async': ['asgiref>=3.6']},
     long_description=read('README.md'),
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Topic :: Utilities",
         "Intended Audience :: Developers",
         "Framework :: Django",
-        "Programming Language :: Python :: 2.7",
+        "Programming Language :: Python :: 3",
         "License :: OSI Approved :: Apache Software License",
     ],
 )